@@ -1,16 +1,20 @@
+import sys
 import json
 import ijson
+import argparse
+from compressed_io import open_file
+from sketches import STAGE1_COUNTS, estimate_stage1
 
 def stream_keys(filepath):
     """Generator that yields keys from a top-level JSON object."""
-    with open(filepath, 'rb') as f:
+    with open_file(filepath, 'rb') as f:
         # This iterates over key-value pairs at the root of the JSON object.
         for key, _ in ijson.kvitems(f, ''):
             yield key
 
 def stream_jsonl_keys(filepath):
     """Generator that yields keys from each JSON object in a JSONL file."""
-    with open(filepath, 'r') as f:
+    with open_file(filepath, 'r') as f:
         for line in f:
             if line.strip():  # Skip any empty lines
                 try:
@@ -27,6 +31,26 @@ def stream_jsonl_keys(filepath):
                 
 data_path = "/mnt/gemini/data/ramith/CMU-project/data/raw"
 
+parser = argparse.ArgumentParser(description="Intersect the raw inputs and save the selected UniProt IDs.")
+parser.add_argument("--estimate", action="store_true",
+                    help="Only estimate the counts below from HyperLogLog/KMV sketches (no ID file is written).")
+parser.add_argument("--sample-fraction", type=float, default=None,
+                    help="With --estimate, sketch random byte ranges covering this fraction of each file.")
+parser.add_argument("--kmv-size", type=int, default=4096,
+                    help="With --estimate, hashes kept per KMV sketch; errors shrink with its square root.")
+parser.add_argument("--sketch-cache", default="sketch_cache",
+                    help="With --estimate, directory where sketches are cached per file fingerprint.")
+args = parser.parse_args()
+
+if args.estimate:
+    estimates = estimate_stage1(f"{data_path}/data", k=args.kmv_size, sample_fraction=args.sample_fraction,
+                                cache_dir=args.sketch_cache)
+    for label, (value, error) in estimates.items():
+        print(f"{label}: ~{max(value, 0):,.0f} ± {error:,.0f}")
+    if len(estimates) < len(STAGE1_COUNTS):
+        print("Intersections are not estimated from byte-range samples; rerun without --sample-fraction for them.")
+    sys.exit(0)
+
 protein2ligand_id  = set(stream_keys(f"{data_path}/data/protein2ligand_id.json"))
 uniprot2seq  = set(stream_keys(f"{data_path}/data/uniprot2seq.json"))
 uniprot2text = set(stream_keys(f"{data_path}/data/uniprot2text.json"))
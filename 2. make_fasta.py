@@ -1,5 +1,20 @@
 import json
 import ijson
+import argparse
+from cluster_stats import sort_length_index, save_length_index
+from compressed_io import open_file
+from mmseqs_db import MMseqsDBWriter
+
+parser = argparse.ArgumentParser(description="Write the selected UniProt sequences to a FASTA file.")
+parser.add_argument("--output", default="output_sequences.fasta",
+                    help="Output FASTA path; a .gz or .zst suffix compresses it.")
+parser.add_argument("--threads", type=int, default=4,
+                    help="Threads used for .zst compression.")
+parser.add_argument("--mmseqs-db", default=None, metavar="PREFIX",
+                    help="Also write an MMseqs2 sequence database at PREFIX, so step 2 can skip createdb.")
+parser.add_argument("--lengths", default="/mnt/gemini/data/ramith/CMU-project/data/raw/data/sequence_lengths.npz",
+                    help="Where to save the sequence length index read by cluster_stats.py.")
+args = parser.parse_args()
 
 # Load selected UniProt IDs into a set
 with open('selected_uniprot_ids.txt', 'r') as id_file:
@@ -7,17 +22,29 @@ with open('selected_uniprot_ids.txt', 'r') as id_file:
 
 data_path = "/mnt/gemini/data/ramith/CMU-project/data/raw"
 
+# Sequence lengths are recorded while we stream, so later analyses
+# (cluster_stats.py) never need to re-read the sequence files.
+length_ids = []
+lengths = []
+
+# The MMseqs2 database is filled in the same pass, entry by entry in FASTA order
+mmseqs_db = MMseqsDBWriter(args.mmseqs_db, source_name=args.output) if args.mmseqs_db else None
+
 # Open the output FASTA file in write mode
-with open(f"output_sequences.fasta", 'w') as fasta_out:
+with open_file(args.output, 'w', threads=args.threads) as fasta_out:
     # First, stream through the main uniprot2seq.json file (13 GB)
 
     c1 = 0
-    with open(f"{data_path}/data/uniprot2seq.json", 'r') as json_file:
+    with open_file(f"{data_path}/data/uniprot2seq.json", 'rb') as json_file:
         # Assumes the JSON structure is a dictionary mapping IDs to sequences
         # Adjust the prefix in kvitems() if your structure is different.
         for uniprot_id, sequence in ijson.kvitems(json_file, ''):
             if uniprot_id in selected_ids:
                 fasta_out.write(f">{uniprot_id}\n{sequence}\n")
+                if mmseqs_db:
+                    mmseqs_db.add(uniprot_id, sequence)
+                length_ids.append(uniprot_id)
+                lengths.append(len(sequence))
                 selected_ids.remove(uniprot_id)  # Remove to avoid duplicate processing
                 c1+=1
 
@@ -25,7 +52,7 @@ with open(f"output_sequences.fasta", 'w') as fasta_out:
 
     c2 = 0
     # Then process the uniref50.jsonl file (19 GB) for any IDs not found above
-    with open(f"{data_path}/data/uniref50.jsonl", 'r') as jsonl_file:
+    with open_file(f"{data_path}/data/uniref50.jsonl", 'r') as jsonl_file:
         for line in jsonl_file:
             record = json.loads(line)
             # Adjust these keys according to your JSONL file's schema
@@ -33,9 +60,20 @@ with open(f"output_sequences.fasta", 'w') as fasta_out:
             
             if uniprot_id in selected_ids:
                 fasta_out.write(f">{uniprot_id}\n{sequence}\n")
+                if mmseqs_db:
+                    mmseqs_db.add(uniprot_id, sequence)
+                length_ids.append(uniprot_id)
+                lengths.append(len(sequence))
                 selected_ids.remove(uniprot_id)
                 c2+=1
 
     print(f"{c2} written from uniref50.jsonl")
 
-print(len(selected_ids))
\ No newline at end of file
+if mmseqs_db:
+    mmseqs_db.close()
+    print(f"{mmseqs_db.count} sequences written to MMseqs2 database {args.mmseqs_db}")
+
+print(len(selected_ids))
+
+save_length_index(args.lengths, *sort_length_index(length_ids, lengths))
+print(f"{len(lengths)} sequence lengths saved to {args.lengths}")
\ No newline at end of file
@@ -1,8 +1,8 @@
 import random
 random.seed(42)
 import json
-import numpy as np
 from helpers import * 
+from incidence import ClusterLigandIncidence
 import plotly.io as pio
 pio.renderers.default = "colab" 
 
@@ -138,52 +138,15 @@ val_cluster   = load_cluster_split("val_clusters.txt")
 test_cluster  = load_cluster_split("test_clusters.txt")
 
 
-# train_cluster_details , train_cluster_counts  = get_uniprot_ids_of_cluster(train_cluster , cluster_mapping_file)
-val_cluster_details , val_cluster_counts  = get_uniprot_ids_of_cluster(val_cluster , cluster_mapping_file)
-test_cluster_details, test_cluster_counts = get_uniprot_ids_of_cluster(test_cluster, cluster_mapping_file)
+# Clusters x ligands pair counts over all clusters, built once; the per-split
+# ligand sets below are sparse row reductions instead of per-protein loops.
+incidence = ClusterLigandIncidence.build(cluster_mapping_file, filtered_protein2ligand)
 
+val_cluster_mask  = incidence.cluster_mask(val_cluster)
+test_cluster_mask = incidence.cluster_mask(test_cluster)
 
-np.array([counts for _, counts in val_cluster_counts]).sum()
-np.array([counts for _, counts in test_cluster_counts]).sum()
-
-
-def load_json_file(filepath):
-    with open(filepath, 'r') as f:
-        return json.load(f)
-
-protein2ligand = load_json_file(f"{data_path}/data/protein2ligand_id.json")
-
-def get_ligands_in_cluster(cluster_details):
-
-    all_ligands = []
-    total_pairings = 0
-    
-    protein_counts_for_ligand = {}
-
-    ligands_for_protein = {}
-    
-    for idx, cluster_info in enumerate(cluster_details.items()):
-        # extend list
-        cluster_proteins = cluster_info[1]
-
-        for current_protein in cluster_proteins:
-            
-            ligands_for_curr_protein = protein2ligand[current_protein]
-            ligands_for_protein[current_protein] = ligands_for_curr_protein
-            
-            for ligand in ligands_for_curr_protein: #loop through each ligand
-                if ligand not in protein_counts_for_ligand:
-                    protein_counts_for_ligand[ligand] = 1
-                else:
-                    protein_counts_for_ligand[ligand] += 1
-            
-            all_ligands.extend(ligands_for_curr_protein)
-            total_pairings += len(ligands_for_curr_protein)
-    
-    
-    num_unique_ligands = len(set(all_ligands))
-
-    return set(all_ligands), protein_counts_for_ligand, num_unique_ligands, ligands_for_protein
+incidence.cluster_sizes[val_cluster_mask].sum()
+incidence.cluster_sizes[test_cluster_mask].sum()
 
 
 def count_overlap_(mmseqs_cluster_random_split_ligands, random_ligand_split):
@@ -196,11 +159,10 @@ def count_overlap_(mmseqs_cluster_random_split_ligands, random_ligand_split):
     return intersection
 
 
-val_all_ligands, val_protein_counts_for_ligand, _, val_ligands_for_protein  = get_ligands_in_cluster(val_cluster_details)
-test_all_ligands, test_protein_counts_for_ligand, _, test_ligands_for_protein = get_ligands_in_cluster(test_cluster_details)
-
-
-test_ligands_for_protein['A0A830GVA3']
+val_all_ligands  = incidence.ligand_set(val_cluster_mask)
+test_all_ligands = incidence.ligand_set(test_cluster_mask)
+val_protein_counts_for_ligand  = incidence.ligand_counts(val_cluster_mask)
+test_protein_counts_for_ligand = incidence.ligand_counts(test_cluster_mask)
 
 
 len(test_all_ligands)
@@ -1,9 +1,23 @@
 import ijson
 import json
 import csv
+import io
+import os
+import copy
+import argparse
+import threading
 from collections import defaultdict
-from typing import Set, Dict, Optional, Generator, Tuple
+from typing import Set, Dict, List, Optional, Generator, Iterable, Tuple
 from transformers import AutoTokenizer
+from pipeline import run_pipeline
+from compressed_io import open_file
+from shards import write_length_bucketed_shards
+from shuffle import external_shuffle
+from dedup import collapse_duplicates
+from residue_vocab import ResidueVocab, SequenceIdWriter, encode_jsonl
+from incremental import patch_jsonl
+from partition import (partition_of, partition_file_name, partition_input_path,
+                       write_partition_manifest)
 
 data_path = "/mnt/gemini/data/ramith/CMU-project/data/raw"
 output_path = "/mnt/gemini/data/ramith/CMU-project/data/raw/data/output"
@@ -18,7 +32,7 @@ tokenizer.add_special_tokens(special_tokens_dict)
 
 def load_json_file(filepath: str) -> dict:
     try:
-        with open(filepath, 'r') as f:
+        with open_file(filepath, 'r') as f:
             return json.load(f)
     except FileNotFoundError:
         raise FileNotFoundError(f"File not found: {filepath}")
@@ -52,7 +66,7 @@ def get_uniprot_ids_from_clusters(cluster_ids: Set[str], cluster_mapping_file: s
 def partial_load(json_path: str, needed_uniprot_ids: Set[str]) -> Dict[str, any]:
     result = {}
     try:
-        with open(json_path, 'rb') as f:
+        with open_file(json_path, 'rb') as f:
             for key, value in ijson.kvitems(f, ''):
                 if key in needed_uniprot_ids:
                     result[key] = value
@@ -88,6 +102,48 @@ def tokenize_text(text: str, tokenizer: AutoTokenizer) -> Dict[str, any]: #token
         "token_ids": token_ids,
     }
 
+def tokenize_texts(texts: List[str], tokenizer: AutoTokenizer) -> List[Dict[str, any]]:
+    """
+    Batched tokenize_text with identical output. A fast tokenizer encodes the
+    whole batch in Rust (encode_batch), which releases the GIL, so worker
+    threads tokenize in parallel instead of taking turns.
+    """
+    if not getattr(tokenizer, "is_fast", False):
+        return [tokenize_text(text, tokenizer) for text in texts]
+    prefixed_texts = [f"The function of the target protein is <FUNCTION> {text} </FUNCTION>" for text in texts]
+    # tokenize() is the tokens of an encoding without special tokens; encode() the ids with them
+    tokens = tokenizer(prefixed_texts, add_special_tokens=False)
+    token_ids = tokenizer(prefixed_texts, add_special_tokens=True)["input_ids"]
+    return [{
+        "original_text": text,
+        "tokenized_text": tokens.tokens(i),
+        "token_ids": token_ids[i],
+    } for i, text in enumerate(texts)]
+
+def build_protein_records(uniprot_id: str, ligand_list: list, tokenized_data: Dict[str, any], seq: str,
+                          ligand2smiles_dict: Dict[str, str],
+                          allowed_ligand_ids: Optional[Set[str]] = None) -> Generator[dict, None, None]:
+    for lig_id in ligand_list:
+        clean_lig_id = strip_sdf(lig_id)
+        if allowed_ligand_ids is not None and clean_lig_id not in allowed_ligand_ids:
+            continue
+
+        smiles = ligand2smiles_dict.get(clean_lig_id, None)
+        if smiles is None:
+            continue
+
+        yield {
+            "input": {
+                "function_original": tokenized_data["original_text"], #original text
+                "function_tokens":   tokenized_data["tokenized_text"], #token strings
+                "function_token_ids":tokenized_data["token_ids"], #token ids
+                "ligand": smiles,
+                "ligand_id": clean_lig_id
+            },
+            "output": seq,
+            "uniprot_id": uniprot_id
+        }
+
 def generate_records(protein2ligand_dict: Dict[str, list], ligand2smiles_dict: Dict[str, str],
                      uniprot2seq_dict: Dict[str, str], uniprot2text_dict: Dict[str, str],
                      allowed_uniprot_ids: Set[str], allowed_ligand_ids: Optional[Set[str]] = None) -> Generator[dict, None, None]:
@@ -103,39 +159,176 @@ def generate_records(protein2ligand_dict: Dict[str, list], ligand2smiles_dict: D
         # --- Tokenization ---
         tokenized_data = tokenize_text(text, tokenizer) #tokenizer added
 
-        for lig_id in ligand_list:
-            clean_lig_id = strip_sdf(lig_id)
-            if allowed_ligand_ids is not None and clean_lig_id not in allowed_ligand_ids:
-                continue
-
-            smiles = ligand2smiles_dict.get(clean_lig_id, None)
-            if smiles is None:
-                continue
-
-            yield {
-                "input": {
-                    "function_original": tokenized_data["original_text"], #original text
-                    "function_tokens":   tokenized_data["tokenized_text"], #token strings
-                    "function_token_ids":tokenized_data["token_ids"], #token ids
-                    "ligand": smiles,
-                    "ligand_id": clean_lig_id
-                },
-                "output": seq,
-                "uniprot_id": uniprot_id
-            }
-
-def write_dataset_jsonl(record_generator: Generator[dict, None, None], out_path: str):
+        yield from build_protein_records(uniprot_id, ligand_list, tokenized_data, seq,
+                                         ligand2smiles_dict, allowed_ligand_ids)
+
+def write_dataset_jsonl(record_generator: Generator[dict, None, None], out_path: str, threads: int = 0):
+    # a .gz / .zst suffix on out_path compresses the output (see compressed_io.open_file)
     try:
-        with open(out_path, 'w') as f:
+        with open_file(out_path, 'w', threads=threads) as f:
             for rec in record_generator:
                 f.write(json.dumps(rec))
                 f.write('\n')
     except Exception as e:
         print(f"Error writing to {out_path}: {e}")
 
+def stream_partial(json_path: str, needed_uniprot_ids: Set[str]) -> Generator[Tuple[str, any], None, None]:
+    """Streaming counterpart of partial_load: yields (key, value) pairs for the needed keys."""
+    try:
+        with open_file(json_path, 'rb') as f:
+            for key, value in ijson.kvitems(f, ''):
+                if key in needed_uniprot_ids:
+                    yield key, value
+    except FileNotFoundError:
+        raise FileNotFoundError(f"JSON file not found: {json_path}")
+
+def stream_joined(seq_path: str, text_path: str,
+                  needed_uniprot_ids: Set[str]) -> Generator[Tuple[str, str, str], None, None]:
+    """
+    Streams the sequence and text files side by side and yields
+    (uniprot_id, seq, text) as soon as both values of an accession are seen.
+
+    Values waiting for their counterpart are buffered, so memory stays small
+    when both files list the accessions in the same order and grows towards
+    one loaded file the more the orders differ. Accessions missing from
+    either file are skipped.
+    """
+    seqs = stream_partial(seq_path, needed_uniprot_ids)
+    texts = stream_partial(text_path, needed_uniprot_ids)
+    pending_seqs = {}
+    pending_texts = {}
+    while seqs is not None or texts is not None:
+        if seqs is not None:
+            item = next(seqs, None)
+            if item is None:
+                seqs = None
+            elif item[0] in pending_texts:
+                yield item[0], item[1], pending_texts.pop(item[0])
+            else:
+                pending_seqs.setdefault(item[0], item[1])
+        if texts is not None:
+            item = next(texts, None)
+            if item is None:
+                texts = None
+            elif item[0] in pending_seqs:
+                yield item[0], pending_seqs.pop(item[0]), item[1]
+            else:
+                pending_texts.setdefault(item[0], item[1])
+        # once one file is exhausted, the values buffered from the other one can never match
+        if seqs is None:
+            pending_texts.clear()
+        if texts is None:
+            pending_seqs.clear()
+
+def batched(items: Iterable, batch_size: int) -> Generator[list, None, None]:
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+_thread_state = threading.local()
+
+def thread_tokenizer() -> AutoTokenizer:
+    """Returns a tokenizer private to the calling thread (fast tokenizers are not safe to share)."""
+    if not hasattr(_thread_state, "tokenizer"):
+        _thread_state.tokenizer = copy.deepcopy(tokenizer)
+    return _thread_state.tokenizer
+
+def make_protein_worker(outputs: List[Tuple[str, Set[str], Optional[Set[str]]]], protein2ligand_dict: Dict[str, list],
+                        ligand2smiles_dict: Dict[str, str]):
+    """
+    Builds the pipeline work function:
+    [(uniprot_id, seq, text), ...] -> [(output_index, serialized_lines, seq), ...]
+
+    The texts of a batch are tokenized in one call and each protein is
+    serialized for every output whose protein set contains it.
+    """
+    def work(batch: List[Tuple[str, str, str]]) -> List[Tuple[int, List[str], str]]:
+        batch = [(uniprot_id, seq, text) for uniprot_id, seq, text in batch
+                 if seq and text and uniprot_id in protein2ligand_dict]
+        tokenized = tokenize_texts([text for _, _, text in batch], thread_tokenizer())
+        results = []
+        for (uniprot_id, seq, _), tokenized_data in zip(batch, tokenized):
+            ligand_list = protein2ligand_dict[uniprot_id]
+            for output_index, (_, allowed_uniprot_ids, allowed_ligand_ids) in enumerate(outputs):
+                if uniprot_id not in allowed_uniprot_ids:
+                    continue
+                lines = [json.dumps(rec) + '\n' for rec in build_protein_records(
+                    uniprot_id, ligand_list, tokenized_data, seq, ligand2smiles_dict, allowed_ligand_ids)]
+                if lines:
+                    results.append((output_index, lines, seq))
+        return results
+    return work
+
 # --- Main Script Execution --- 
+parser = argparse.ArgumentParser(description="Generate the tokenized train/val/test datasets.")
+parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                    help="Number of tokenize/serialize worker threads.")
+parser.add_argument("--max-in-flight", type=int, default=4096,
+                    help="Maximum number of proteins read but not yet written.")
+parser.add_argument("--tokenize-batch", type=int, default=64,
+                    help="Proteins whose texts a worker tokenizes in one batched tokenizer call.")
+parser.add_argument("--compress", choices=["none", "gz", "zst"], default="none",
+                    help="Compress the output files (zst output is seekable by uncompressed offset).")
+parser.add_argument("--compress-threads", type=int, default=4,
+                    help="Threads used for zst compression of each output file.")
+parser.add_argument("--sequence-ids", action="store_true",
+                    help="Also write every output's target sequences as uint8 residue IDs "
+                         "(<file>.output_ids.bin + <file>.output_offsets.npy, in record order).")
+parser.add_argument("--residue-vocab", default=None,
+                    help="JSON residue vocabulary for --sequence-ids (residues, nonstandard, specials); "
+                         "defaults to the 20 standard amino acids.")
+parser.add_argument("--collapse-duplicates", action="store_true",
+                    help="Also write the training split with exact-duplicate (function text, ligand, sequence) "
+                         "records collapsed; bucketed and shuffled shards are then built from it.")
+parser.add_argument("--dedup-memory-gb", type=float, default=8.0,
+                    help="Approximate memory budget for --collapse-duplicates before spilling to disk.")
+parser.add_argument("--bucketed-shards", default=None,
+                    help="Also write the training split as length-bucketed shards with packing plans to this "
+                         "directory, relative to the output directory (like train_shuffled/).")
+parser.add_argument("--pack-token-budget", type=int, default=4096,
+                    help="Token budget (function tokens + residues) per pack for --bucketed-shards.")
+parser.add_argument("--shard-size", type=int, default=100000,
+                    help="Maximum records per bucketed shard.")
+parser.add_argument("--shuffle-shards", type=int, default=0,
+                    help="Also write a globally shuffled copy of the training split as this many shards.")
+parser.add_argument("--shuffle-seed", type=int, default=42,
+                    help="Seed for --shuffle-shards.")
+parser.add_argument("--shuffle-memory-gb", type=float, default=8.0,
+                    help="Approximate memory budget for the in-memory pass of --shuffle-shards.")
+parser.add_argument("--patch", default=None,
+                    help="Delta directory written by incremental.py: only regenerate the affected proteins "
+                         "and patch the existing outputs in place.")
+parser.add_argument("--num-partitions", type=int, default=1,
+                    help="Split the proteins into this many accession-hash partitions (one per node).")
+parser.add_argument("--partition-id", type=int, default=0,
+                    help="Partition handled by this run, in [0, --num-partitions).")
+parser.add_argument("--partitioned-inputs", default=None,
+                    help="Directory written by `partition.py split-inputs`, so this run only reads its slice.")
+args = parser.parse_args()
+
+if not 0 <= args.partition_id < args.num_partitions:
+    parser.error(f"--partition-id must be in [0, {args.num_partitions})")
+partitioned = args.num_partitions > 1
+
+def out_name(file_name: str) -> str:
+    return partition_file_name(file_name, args.partition_id, args.num_partitions) if partitioned else file_name
+
+seq_path = f"{data_path}/data/uniprot2seq.json"
+text_path = f"{data_path}/data/uniprot2text.json"
+if partitioned and args.partitioned_inputs:
+    seq_path = partition_input_path(args.partitioned_inputs, "uniprot2seq.json", args.partition_id, args.num_partitions)
+    text_path = partition_input_path(args.partitioned_inputs, "uniprot2text.json", args.partition_id, args.num_partitions)
+
 # 1. Load Data and Cluster/Ligand IDs
 cluster_mapping_file = f"{data_path}/data/clusterRes_cluster.tsv"  # Path to your cluster mapping file
+if args.patch:
+    # the delta directory holds the stored mapping plus the newly assigned proteins
+    cluster_mapping_file = f"{args.patch}/clusterRes_cluster.tsv"
 
 train_cluster_ids = load_cluster_ids("train_clusters.txt")
 val_cluster_ids = load_cluster_ids("val_clusters.txt")
@@ -154,101 +347,136 @@ ligand2smiles = load_json_file(f"{data_path}/data/ligand2smiles.json")
 # print(f"Loaded ligand2smiles of {len(ligand2smiles):,} ligands.") No need to print this every time.
 
 # Get *all* needed uniprot IDs, for loading sequence/text data
-all_needed_uniprot_ids = train_uniprot_ids | val_uniprot_ids | test_uniprot_ids
+all_needed_uniprot_ids = (train_uniprot_ids | val_uniprot_ids | test_uniprot_ids) & protein2ligand.keys()
 
-uniprot2seq  = partial_load(f"{data_path}/data/uniprot2seq.json", all_needed_uniprot_ids)  # Efficient loading!
-uniprot2text = partial_load(f"{data_path}/data/uniprot2text.json", all_needed_uniprot_ids)
+if partitioned:
+    all_needed_uniprot_ids = {u for u in all_needed_uniprot_ids
+                              if partition_of(u, args.num_partitions) == args.partition_id}
+    print(f"Partition {args.partition_id}/{args.num_partitions}: {len(all_needed_uniprot_ids):,} proteins.")
 
+if args.patch:
+    affected_uniprot_ids = load_cluster_ids(f"{args.patch}/affected_uniprot_ids.txt") - {""}
+    all_needed_uniprot_ids &= affected_uniprot_ids
+    print(f"Patching {len(all_needed_uniprot_ids):,} of {len(affected_uniprot_ids):,} affected proteins.")
 
-# ### Save test and validation splits that have seen ligands during training
+print(f"total unique val protein_ids {len(val_uniprot_ids)}")
+print(f"total unique test protein_ids {len(test_uniprot_ids)}")
 
 train_allowed_ligands = set(ligand2smiles.keys()) - val_ligand_ids - test_ligand_ids  #Correct way to get allowed training ligands
 
-# Restrict protein2ligand to just the validation proteins
-val_protein2ligand = {k: v for k, v in protein2ligand.items() if k in val_uniprot_ids}
-
-print(f"total unique protein_ids {len(val_uniprot_ids)}")
-
-val_record_gen = generate_records(
-    val_protein2ligand,
-    ligand2smiles,
-    uniprot2seq,
-    uniprot2text,
-    val_uniprot_ids,
-    train_allowed_ligands   # here we want the ligands to be stuff we saw during training
-)
-write_dataset_jsonl(val_record_gen, f"{output_path}/val_dataset_seen_ligands_tokenized.jsonl") #file name changed
-print("Done writing validation dataset [seen ligands].")
-
-
-# Restrict protein2ligand
-test_protein2ligand = {k: v for k, v in protein2ligand.items() if k in test_uniprot_ids}
-
-print(f"total unique protein_ids {len(test_uniprot_ids)}")
-
-test_record_gen = generate_records(
-    test_protein2ligand,
-    ligand2smiles,
-    uniprot2seq,
-    uniprot2text,
-    test_uniprot_ids,
-    train_allowed_ligands # here we want the ligands to be stuff we saw during training
-)
-write_dataset_jsonl(test_record_gen, f"{output_path}/test.dataset_seen_ligands_tokenized.jsonl") #file name changed
-print("Done writing test dataset [seen ligands].")
-
-
-# ### Save unseen ligands in train for val and test set 
-
-# --- Validation Data ---
-# Restrict protein2ligand to just the validation proteins
-val_protein2ligand = {k: v for k, v in protein2ligand.items() if k in val_uniprot_ids}
-
-val_record_gen = generate_records(
-    val_protein2ligand,
-    ligand2smiles,
-    uniprot2seq,
-    uniprot2text,
-    val_uniprot_ids,
-    val_ligand_ids   # Only allow validation ligands
-)
-write_dataset_jsonl(val_record_gen, f"{output_path}/val_dataset_tokenized.jsonl") #file name changed
-print("Done writing validation dataset.")
-
-
-# --- Test Data ---
-# Restrict protein2ligand
-test_protein2ligand = {k: v for k, v in protein2ligand.items() if k in test_uniprot_ids}
-
-test_record_gen = generate_records(
-    test_protein2ligand,
-    ligand2smiles,
-    uniprot2seq,
-    uniprot2text,
-    test_uniprot_ids,
-    test_ligand_ids  # Only allow test ligands
-)
-write_dataset_jsonl(test_record_gen, f"{output_path}/test.dataset_both_unseen_tokenized.jsonl") #file name changed
-print("Done writing test dataset.")
-
 # 2. Generate and Write Datasets
-
-# --- Training Data ---
-#  * Exclude val and test ligands
-train_allowed_ligands = set(ligand2smiles.keys()) - val_ligand_ids - test_ligand_ids  #Correct way to get allowed training ligands
-# Restrict protein2ligand to just the training proteins we care about
-train_protein2ligand = {k: v for k, v in protein2ligand.items() if k in train_uniprot_ids}
-
-train_record_gen = generate_records(
-    train_protein2ligand,
-    ligand2smiles,
-    uniprot2seq,
-    uniprot2text,
-    train_uniprot_ids,
-    train_allowed_ligands
-)
-write_dataset_jsonl(train_record_gen, f"{output_path}/train_dataset_tokenized.jsonl") #file name changed
-print("Done writing training dataset.")
-
-
-len(train_allowed_ligands)
\ No newline at end of file
+# (file name, allowed proteins, allowed ligands)
+outputs = [
+    # seen ligands: test and validation splits with ligands we saw during training
+    ("val_dataset_seen_ligands_tokenized.jsonl", val_uniprot_ids, train_allowed_ligands),
+    ("test.dataset_seen_ligands_tokenized.jsonl", test_uniprot_ids, train_allowed_ligands),
+    # unseen ligands: only the ligands set aside for validation / test
+    ("val_dataset_tokenized.jsonl", val_uniprot_ids, val_ligand_ids),
+    ("test.dataset_both_unseen_tokenized.jsonl", test_uniprot_ids, test_ligand_ids),
+    # training: exclude val and test ligands
+    ("train_dataset_tokenized.jsonl", train_uniprot_ids, train_allowed_ligands),
+]
+
+# The sequences and texts are streamed on the reader thread while the workers
+# tokenize and serialize earlier batches and the writer appends them in read order.
+suffix = "" if args.compress == "none" else f".{args.compress}"
+if args.patch:
+    # the regenerated records are few: collect them and splice them into the existing files below
+    out_files = [io.StringIO() for _ in outputs]
+else:
+    out_files = [open_file(f"{output_path}/{out_name(file_name)}{suffix}", 'w', threads=args.compress_threads)
+                 for file_name, _, _ in outputs]
+
+residue_vocab = None
+id_writers = []
+if args.sequence_ids:
+    residue_vocab = ResidueVocab.load(args.residue_vocab) if args.residue_vocab else ResidueVocab()
+    residue_vocab.save(f"{output_path}/residue_vocab.json")
+    if not args.patch:
+        # the writer thread batches the sequences of each output and encodes them with one table lookup
+        id_writers = [SequenceIdWriter(f"{output_path}/{out_name(file_name)}", residue_vocab)
+                      for file_name, _, _ in outputs]
+try:
+    def write_lines(results: List[Tuple[int, List[str], str]]):
+        for output_index, lines, seq in results:
+            out_files[output_index].writelines(lines)
+            if id_writers:
+                id_writers[output_index].add(seq, len(lines))
+
+    run_pipeline(
+        batched(stream_joined(seq_path, text_path, all_needed_uniprot_ids), args.tokenize_batch),
+        make_protein_worker(outputs, protein2ligand, ligand2smiles),
+        write_lines,
+        num_workers=args.workers,
+        max_in_flight=max(1, args.max_in_flight // args.tokenize_batch),
+    )
+    if args.patch:
+        for (file_name, _, _), f in zip(outputs, out_files):
+            new_lines = f.getvalue().splitlines(keepends=True)
+            dropped, added = patch_jsonl(f"{output_path}/{out_name(file_name)}{suffix}", affected_uniprot_ids, new_lines)
+            print(f"Patched {out_name(file_name)}{suffix}: {dropped:,} records removed, {added:,} added.")
+finally:
+    for f in out_files:
+        f.close()
+    for w in id_writers:
+        w.close()
+
+if args.patch and residue_vocab:
+    # the patched files changed record order, so their sidecars are rebuilt in full
+    for file_name, _, _ in outputs:
+        encode_jsonl(f"{output_path}/{out_name(file_name)}{suffix}", residue_vocab)
+
+for file_name, _, _ in outputs:
+    print(f"Done writing {out_name(file_name)}{suffix}.")
+
+train_path = f"{output_path}/{out_name('train_dataset_tokenized.jsonl')}{suffix}"
+if args.collapse_duplicates:
+    dedup_path = f"{output_path}/{out_name('train_dataset_dedup_tokenized.jsonl')}{suffix}"
+    stats = collapse_duplicates(train_path, dedup_path, int(args.dedup_memory_gb * 1024 ** 3),
+                                threads=args.compress_threads)
+    print(f"Done writing {out_name('train_dataset_dedup_tokenized.jsonl')}{suffix}: "
+          f"{stats['records']:,} training records collapsed to {stats['unique']:,}.")
+    train_path = dedup_path
+    if residue_vocab:
+        encode_jsonl(dedup_path, residue_vocab)
+
+# shard directories derived from the training split, one per partition
+shard_dirs = {}
+if args.bucketed_shards:
+    bucketed_dir = os.path.join(output_path, args.bucketed_shards)
+    if partitioned:
+        bucketed_dir = f"{bucketed_dir}/{args.partition_id:05d}"
+    manifest = write_length_bucketed_shards(
+        train_path,
+        bucketed_dir,
+        args.pack_token_budget,
+        shard_size=args.shard_size,
+        suffix=suffix,
+    )
+    shard_dirs["bucketed_shards"] = bucketed_dir
+    print(f"Done writing {manifest['records']:,} training records as bucketed shards to {bucketed_dir}.")
+
+if args.shuffle_shards:
+    shuffle_dir = f"{output_path}/train_shuffled"
+    if partitioned:
+        shuffle_dir = f"{shuffle_dir}/{args.partition_id:05d}"
+    manifest = external_shuffle(
+        train_path,
+        shuffle_dir,
+        args.shuffle_shards,
+        seed=args.shuffle_seed,
+        memory_budget=int(args.shuffle_memory_gb * 1024 ** 3),
+        suffix=suffix,
+    )
+    shard_dirs["train_shuffled"] = shuffle_dir
+    print(f"Done writing {manifest['records']:,} shuffled training records to {shuffle_dir}.")
+
+if partitioned:
+    # per-partition record counts and checksums, written last so it only
+    # appears once everything is done; `partition.py merge` combines them
+    file_names = [file_name for file_name, _, _ in outputs]
+    if args.collapse_duplicates:
+        file_names.append('train_dataset_dedup_tokenized.jsonl')
+    write_partition_manifest(output_path, file_names, args.partition_id, args.num_partitions, suffix, shard_dirs)
+
+len(train_allowed_ligands)
@@ -0,0 +1,193 @@
+import csv
+import json
+import os
+import random
+import sys
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from cluster_stats import load_cluster_index, lookup_sorted  # noqa: E402
+from compressed_io import open_file  # noqa: E402
+
+_BATCH_SIZE = 4096
+
+
+def farthest_first(lengths: List[int], m: int) -> List[int]:
+    """
+    Indices of m maximally-spread lengths (same rule as farthest_first_subset
+    in cluster_sizes.ipynb: start at the longest, then repeatedly take the
+    length farthest from everything chosen so far).
+    """
+    arr = np.asarray(lengths)
+    if m <= 0:
+        return []
+    if m >= len(arr):
+        return list(range(len(arr)))
+
+    chosen = [int(np.argmax(arr))]
+    nearest_dist = np.abs(arr - arr[chosen[0]])
+    nearest_dist[chosen[0]] = -1
+    for _ in range(1, m):
+        next_idx = int(np.argmax(nearest_dist))
+        chosen.append(next_idx)
+        nearest_dist = np.minimum(nearest_dist, np.abs(arr - arr[next_idx]))
+        nearest_dist[chosen] = -1
+    return chosen
+
+
+class Reservoir:
+    """Seeded uniform sample (algorithm R) of at most `capacity` items."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.seen = 0
+        self.items = []
+
+    def add(self, item, rng: random.Random):
+        self.seen += 1
+        if len(self.items) < self.capacity:
+            self.items.append(item)
+        else:
+            j = rng.randrange(self.seen)
+            if j < self.capacity:
+                self.items[j] = item
+
+
+def ligand_quotas(cluster_reservoirs: Dict[str, Reservoir], per_cluster_cap: int, per_ligand_cap: int) -> Dict[str, int]:
+    """
+    Splits a cluster's quota evenly over its ligands, like downsample_cluster
+    in cluster_sizes.ipynb. The remainder goes to the first ligands, so clusters
+    with more ligands than the cap still contribute.
+    """
+    ligands = list(cluster_reservoirs)
+    base, remainder = divmod(per_cluster_cap, len(ligands))
+    return {ligand: min(per_ligand_cap, base + (1 if i < remainder else 0)) for i, ligand in enumerate(ligands)}
+
+
+def downsample_jsonl(input_jsonl: str, output_jsonl: str, allow_list_path: str, cluster_mapping_file: str,
+                     per_cluster_cap: int = 30, per_ligand_cap: int = 30, length_diverse: bool = False,
+                     reservoir_size: Optional[int] = None, seed: int = 42) -> Dict[str, int]:
+    """
+    Downsamples a split JSONL file in one streaming pass.
+
+    Every record goes into a seeded reservoir for its (cluster, ligand) pair.
+    After the pass each cluster keeps at most `per_cluster_cap` records, split
+    evenly over its ligands and at most `per_ligand_cap` per ligand. With
+    `length_diverse`, each reservoir holds a larger pool and the kept records
+    are the most spread-out sequence lengths of that pool.
+
+    Memory is bounded by the number of (cluster, ligand) pairs times the
+    reservoir size, independent of the size of the input.
+
+    Args:
+        input_jsonl: Split file written by stage 5 (e.g. test.dataset_both_unseen_tokenized.jsonl).
+        output_jsonl: Downsampled file; line numbers of the kept records go to `<output_jsonl>.line_numbers.txt`.
+        allow_list_path: Where to save the kept (protein_id, ligand_id) pairs (same format keep_ids.py reads).
+        cluster_mapping_file: clusterRes_cluster.tsv.
+        per_cluster_cap: Maximum records per cluster.
+        per_ligand_cap: Maximum records per (cluster, ligand).
+        length_diverse: Pick the kept records by farthest-first sequence length.
+        reservoir_size: Records sampled per (cluster, ligand); defaults to the
+            largest possible quota, or 8 times that with `length_diverse`.
+        seed: Random seed.
+
+    Returns:
+        dict with the number of lines read, records kept and records without a cluster.
+    """
+    cap = min(per_cluster_cap, per_ligand_cap)
+    if reservoir_size is None:
+        reservoir_size = cap * 8 if length_diverse else cap
+    reservoir_size = max(reservoir_size, cap)
+
+    print(f"Loading cluster mapping from {cluster_mapping_file}...")
+    cluster_names, protein_ids, protein_cluster = load_cluster_index(cluster_mapping_file)
+
+    rng = random.Random(seed)
+    reservoirs: Dict[str, Dict[str, Reservoir]] = {}
+    total_lines = 0
+    unclustered = 0
+
+    def flush(batch: List[Tuple[int, str, dict]]):
+        nonlocal unclustered
+        pos = lookup_sorted(protein_ids, np.asarray([rec["uniprot_id"] for _, _, rec in batch], dtype='S'))
+        for (line_number, line, rec), p in zip(batch, pos.tolist()):
+            if p < 0:
+                unclustered += 1
+                continue
+            cluster = cluster_names[protein_cluster[p]]
+            ligand = rec["input"]["ligand_id"]
+            reservoir = reservoirs.setdefault(cluster, {}).get(ligand)
+            if reservoir is None:
+                reservoir = reservoirs[cluster][ligand] = Reservoir(reservoir_size)
+            reservoir.add((line_number, line, rec["uniprot_id"], len(rec["output"])), rng)
+
+    print(f"Starting to downsample {input_jsonl}...")
+    with open_file(input_jsonl, 'r') as infile:
+        batch = []
+        for line in infile:
+            total_lines += 1
+            try:
+                batch.append((total_lines, line, json.loads(line)))
+            except json.JSONDecodeError:
+                print(f"Skipping malformed line {total_lines}: {line.strip()}")
+                continue
+            if len(batch) == _BATCH_SIZE:
+                flush(batch)
+                batch = []
+        if batch:
+            flush(batch)
+
+    kept = []
+    for cluster, cluster_reservoirs in reservoirs.items():
+        for ligand, quota in ligand_quotas(cluster_reservoirs, per_cluster_cap, per_ligand_cap).items():
+            items = cluster_reservoirs[ligand].items
+            if length_diverse:
+                selected = [items[i] for i in farthest_first([length for *_, length in items], quota)]
+            else:
+                # the reservoir is uniform, but its order is not once it has filled up
+                selected = rng.sample(items, min(quota, len(items)))
+            kept.extend((line_number, line, protein, ligand) for line_number, line, protein, _ in selected)
+    kept.sort()
+
+    with open_file(output_jsonl, 'w') as outfile, \
+            open(output_jsonl + '.line_numbers.txt', 'w') as line_file, \
+            open(allow_list_path, 'w', newline='') as allow_file:
+        writer = csv.writer(allow_file, delimiter='\t')
+        writer.writerow(['protein_id', 'ligand_id'])
+        for line_number, line, protein, ligand in kept:
+            outfile.write(line if line.endswith('\n') else line + '\n')
+            line_file.write(f"{line_number}\n")
+            writer.writerow([protein, ligand])
+
+    print("\n--- Downsampling Complete ---")
+    print(f"Total lines read: {total_lines:,}")
+    print(f"Lines kept: {len(kept):,} from {len(reservoirs):,} clusters")
+    if unclustered:
+        print(f"Records without a cluster (skipped): {unclustered:,}")
+    print(f"New downsampled file saved to: {output_jsonl}")
+    return {"lines": total_lines, "kept": len(kept), "unclustered": unclustered}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    data_path = "/mnt/gemini/data/ramith/CMU-project/data"
+
+    parser = argparse.ArgumentParser(description="Stratified single-pass downsampling of an eval split.")
+    parser.add_argument("--input", default=f"{data_path}/splits_with_instruction/has_ligand/test.dataset_both_unseen_tokenized.jsonl")
+    parser.add_argument("--output", default="test_unseen_downsampled.jsonl")
+    parser.add_argument("--allow-list", default="allow_list.tsv")
+    parser.add_argument("--cluster-mapping", default=f"{data_path}/raw/data/clusterRes_cluster.tsv")
+    parser.add_argument("--per-cluster-cap", type=int, default=30)
+    parser.add_argument("--per-ligand-cap", type=int, default=30)
+    parser.add_argument("--length-diverse", action="store_true",
+                        help="Keep the most spread-out sequence lengths of each reservoir instead of a uniform sample.")
+    parser.add_argument("--reservoir-size", type=int, default=None)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    downsample_jsonl(args.input, args.output, args.allow_list, args.cluster_mapping,
+                     args.per_cluster_cap, args.per_ligand_cap, args.length_diverse,
+                     args.reservoir_size, args.seed)
@@ -0,0 +1,216 @@
+import json
+from typing import Dict, Iterable, Tuple
+
+import numpy as np
+import pandas as pd
+
+from compressed_io import open_file
+
+data_path = "/mnt/gemini/data/ramith/CMU-project/data/raw"
+
+# Columns of a split record that are counted as "unique per cluster".
+UNIQUE_COLUMNS = {
+    "ligand_id": "ligand_count",
+    "function_original": "ann_count",
+    "function_full": "prompt_count",
+}
+
+
+def sort_length_index(ids: Iterable[str], lengths: Iterable[int]) -> Tuple[np.ndarray, np.ndarray]:
+    ids = np.asarray(list(ids), dtype='S')
+    lengths = np.asarray(list(lengths), dtype=np.uint32)
+    order = np.argsort(ids, kind='stable')
+    return ids[order], lengths[order]
+
+
+def save_length_index(out_path: str, ids: np.ndarray, lengths: np.ndarray):
+    np.savez(out_path, ids=ids, lengths=lengths)
+
+
+def load_length_index(path: str) -> Tuple[np.ndarray, np.ndarray]:
+    try:
+        with np.load(path) as data:
+            return data["ids"], data["lengths"]
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Length index not found: {path}")
+
+
+def lookup_sorted(sorted_ids: np.ndarray, query_ids) -> np.ndarray:
+    """
+    Returns the position of every query ID in a sorted ID array, or -1 where
+    the ID is absent.
+    """
+    query_ids = np.asarray(query_ids, dtype='S')
+    if len(sorted_ids) == 0:
+        return np.full(len(query_ids), -1, dtype=np.int64)
+    pos = np.searchsorted(sorted_ids, query_ids)
+    pos = np.minimum(pos, len(sorted_ids) - 1)
+    return np.where(sorted_ids[pos] == query_ids, pos, -1)
+
+
+def load_cluster_index(cluster_mapping_file: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Loads clusterRes_cluster.tsv into columnar form.
+
+    Returns:
+        (cluster_names, protein_ids, protein_cluster) where protein_ids is a
+        sorted bytes array and protein_cluster[i] is the index into
+        cluster_names of the cluster that protein_ids[i] belongs to.
+    """
+    try:
+        df = pd.read_csv(cluster_mapping_file, sep='\t', header=None, usecols=[0, 1],
+                         names=["cluster_id", "uniprot_id"], dtype=str)
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Cluster mapping file not found: {cluster_mapping_file}")
+
+    codes, cluster_names = pd.factorize(df["cluster_id"])
+    protein_ids = df["uniprot_id"].to_numpy(dtype='S')
+    order = np.argsort(protein_ids, kind='stable')
+    return np.asarray(cluster_names, dtype=object), protein_ids[order], codes[order].astype(np.int32)
+
+
+def load_split_columns(jsonl_path: str) -> pd.DataFrame:
+    """Reads the per-record columns needed for cluster statistics from a split JSONL."""
+    columns = {"uniprot_id": [], "ligand_id": [], "function_original": [], "function_full": []}
+    with open_file(jsonl_path, 'r') as f:
+        for line_num, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                data = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Error parsing line {line_num}: {e}")
+                continue
+            inputs = data.get('input', {})
+            columns["uniprot_id"].append(data.get('uniprot_id'))
+            columns["ligand_id"].append(inputs.get('ligand_id'))
+            columns["function_original"].append(inputs.get('function_original'))
+            columns["function_full"].append(inputs.get('function_full'))
+    return pd.DataFrame(columns)
+
+
+def records_from_protein2ligand(protein2ligand: Dict[str, list]) -> pd.DataFrame:
+    """Explodes a protein2ligand mapping into one (uniprot_id, ligand_id) row per pairing."""
+    uniprot_ids = []
+    ligand_ids = []
+    for uniprot_id, ligand_list in protein2ligand.items():
+        uniprot_ids.extend([uniprot_id] * len(ligand_list))
+        ligand_ids.extend(ligand_list)
+    return pd.DataFrame({"uniprot_id": uniprot_ids, "ligand_id": ligand_ids})
+
+
+def _count_unique_pairs(cluster_codes: np.ndarray, values: pd.Series, n_clusters: int) -> np.ndarray:
+    value_codes, uniques = pd.factorize(values)
+    keys = cluster_codes.astype(np.int64) * (len(uniques) + 1) + (value_codes + 1)
+    keys = np.unique(keys[value_codes >= 0])
+    return np.bincount(keys // (len(uniques) + 1), minlength=n_clusters)
+
+
+def _segment_stats(cluster_codes: np.ndarray, lengths: np.ndarray, n_clusters: int) -> Dict[str, np.ndarray]:
+    """Mean/std/min/max of lengths grouped by cluster, NaN for empty clusters."""
+    counts = np.bincount(cluster_codes, minlength=n_clusters)
+    sums = np.bincount(cluster_codes, weights=lengths, minlength=n_clusters)
+    sq_sums = np.bincount(cluster_codes, weights=lengths.astype(np.float64) ** 2, minlength=n_clusters)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / counts
+        std = np.sqrt(np.maximum(sq_sums / counts - mean ** 2, 0.0))
+
+    min_length = np.full(n_clusters, np.nan)
+    max_length = np.full(n_clusters, np.nan)
+    if len(cluster_codes):
+        order = np.argsort(cluster_codes, kind='stable')
+        sorted_codes = cluster_codes[order]
+        sorted_lengths = lengths[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        present = sorted_codes[starts]
+        min_length[present] = np.minimum.reduceat(sorted_lengths, starts)
+        max_length[present] = np.maximum.reduceat(sorted_lengths, starts)
+
+    return {"count": counts, "mean": mean, "std_dev": std,
+            "min_length": min_length, "max_length": max_length}
+
+
+def compute_cluster_stats(records: pd.DataFrame, cluster_index, length_index) -> pd.DataFrame:
+    """
+    Computes per-cluster statistics with NumPy group-by reductions.
+
+    This is the columnar replacement for the notebook's add_to_cluster_info:
+    every cluster in the cluster index gets a row, clusters without records
+    have zero counts and NaN length statistics.
+
+    Args:
+        records: DataFrame with a 'uniprot_id' column and optionally any of
+                 'ligand_id', 'function_original', 'function_full'.
+        cluster_index: Output of load_cluster_index.
+        length_index: Output of load_length_index.
+
+    Returns:
+        A DataFrame indexed by cluster_id.
+    """
+    cluster_names, cluster_protein_ids, protein_cluster = cluster_index
+    length_ids, lengths = length_index
+    n_clusters = len(cluster_names)
+
+    protein_ids = records["uniprot_id"].to_numpy(dtype='S')
+    cluster_pos = lookup_sorted(cluster_protein_ids, protein_ids)
+    length_pos = lookup_sorted(length_ids, protein_ids)
+
+    missing_cluster = int((cluster_pos < 0).sum())
+    if missing_cluster:
+        print(f"Warning: {missing_cluster:,} records have no entry in the cluster mapping.")
+    missing_length = int(((cluster_pos >= 0) & (length_pos < 0)).sum())
+    if missing_length:
+        print(f"Warning: {missing_length:,} records have no entry in the length index.")
+
+    keep = (cluster_pos >= 0) & (length_pos >= 0)
+    records = records[keep]
+    codes = protein_cluster[cluster_pos[keep]]
+    record_lengths = lengths[length_pos[keep]].astype(np.float64)
+
+    member_stats = _segment_stats(codes, record_lengths, n_clusters)
+
+    # unique members: first occurrence of each protein
+    protein_codes, _ = pd.factorize(records["uniprot_id"])
+    _, first = np.unique(protein_codes, return_index=True)
+    unique_stats = _segment_stats(codes[first], record_lengths[first], n_clusters)
+
+    table = pd.DataFrame({
+        "members": member_stats["count"],
+        "unique_members": unique_stats["count"],
+        "mean": member_stats["mean"],
+        "std_dev": member_stats["std_dev"],
+        "min_length": member_stats["min_length"],
+        "max_length": member_stats["max_length"],
+        "unique_mean": unique_stats["mean"],
+    }, index=pd.Index(cluster_names, name="cluster_id"))
+
+    for column, out_column in UNIQUE_COLUMNS.items():
+        if column in records:
+            table[out_column] = _count_unique_pairs(codes, records[column], n_clusters)
+
+    return table
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Per-cluster statistics of a split file.")
+    parser.add_argument("split_file")
+    parser.add_argument("out_file", nargs="?", default="cluster_stats.tsv")
+    parser.add_argument("--lengths", default=f"{data_path}/data/sequence_lengths.npz",
+                        help="Sequence length index written by 2. make_fasta.py (same default as its --lengths).")
+    parser.add_argument("--cluster-mapping", default=f"{data_path}/data/clusterRes_cluster.tsv")
+    args = parser.parse_args()
+    out_file = args.out_file
+
+    cluster_index = load_cluster_index(args.cluster_mapping)
+    length_index = load_length_index(args.lengths)
+
+    records = load_split_columns(args.split_file)
+    stats = compute_cluster_stats(records, cluster_index, length_index)
+    stats.to_csv(out_file, sep='\t')
+
+    present = stats[stats["members"] > 0]
+    print(f"Clusters with records: {len(present):,} / {len(stats):,}")
+    print(f"Cluster stats saved to {out_file}")
@@ -0,0 +1,268 @@
+import bisect
+import gzip
+import io
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Tuple
+
+COMPRESSED_SUFFIXES = (".zst", ".gz")
+
+# zstd seekable format (contrib/seekable_format in the zstd repository):
+# a skippable frame at the end of the file listing the compressed and
+# decompressed size of every frame, followed by a 9 byte footer.
+_SKIPPABLE_MAGIC = 0x184D2A5E
+_SEEKABLE_MAGIC = 0x8F92EAB1
+_FOOTER_SIZE = 9
+
+DEFAULT_FRAME_SIZE = 4 * 1024 * 1024
+
+
+def _zstd():
+    try:
+        import zstandard
+    except ImportError:
+        raise ImportError("Reading or writing .zst files requires the 'zstandard' package (pip install zstandard)")
+    return zstandard
+
+
+def resolve_path(path: str) -> str:
+    """
+    Returns `path` if it exists, otherwise the first existing compressed
+    variant (`path.zst`, `path.gz`), so scripts with hard-coded input names
+    pick up compressed data drops without edits.
+    """
+    if os.path.exists(path):
+        return path
+    for suffix in COMPRESSED_SUFFIXES:
+        if os.path.exists(path + suffix):
+            return path + suffix
+    raise FileNotFoundError(f"File not found: {path}")
+
+
+def open_file(path: str, mode: str = 'r', threads: int = 0, level: int = 3,
+              frame_size: int = DEFAULT_FRAME_SIZE):
+    """
+    Opens a plain, gzip or zstd file based on its extension.
+
+    Reading resolves compressed variants of `path` (see resolve_path).
+    Writing `.zst` produces a seekable zstd file made of independent frames
+    of `frame_size` uncompressed bytes, compressed on `threads` threads
+    (0 compresses on the calling thread).
+
+    Args:
+        path: File to open.
+        mode: One of 'r', 'rb', 'w', 'wb'.
+        threads: Compression threads for `.zst` output.
+        level: Compression level for `.zst` and `.gz` output.
+        frame_size: Uncompressed bytes per frame for `.zst` output.
+
+    Returns:
+        A file object (text mode unless 'b' is in mode).
+    """
+    if mode not in ('r', 'rb', 'w', 'wb'):
+        raise ValueError(f"Unsupported mode: {mode}")
+    binary = 'b' in mode
+    writing = 'w' in mode
+
+    if not writing:
+        path = resolve_path(path)
+
+    if path.endswith(".gz"):
+        if writing:
+            fh = gzip.open(path, 'wb', compresslevel=min(max(level, 1), 9))
+        else:
+            fh = gzip.open(path, 'rb')
+    elif path.endswith(".zst"):
+        if writing:
+            fh = io.BufferedWriter(SeekableZstdWriter(path, threads=threads, level=level, frame_size=frame_size),
+                                   buffer_size=frame_size)
+        else:
+            raw = open(path, 'rb')
+            fh = io.BufferedReader(_zstd().ZstdDecompressor().stream_reader(raw, read_across_frames=True, closefd=True))
+    else:
+        return open(path, mode)
+
+    return fh if binary else io.TextIOWrapper(fh, encoding='utf-8')
+
+
+class SeekableZstdWriter(io.RawIOBase):
+    """
+    Writes a zstd seekable-format file: the input is cut into independent
+    frames of `frame_size` bytes and a seek table is appended on close.
+    Any zstd decoder reads the file as a normal stream; SeekableZstdReader
+    can additionally jump to an uncompressed offset.
+    """
+
+    def __init__(self, path: str, threads: int = 0, level: int = 3, frame_size: int = DEFAULT_FRAME_SIZE):
+        super().__init__()
+        self._zstd = _zstd()
+        self._fh = open(path, 'wb')
+        self._level = level
+        self._frame_size = frame_size
+        self._buffer = bytearray()
+        self._frames: List[Tuple[int, int]] = []  # (compressed size, decompressed size)
+        self._pool = ThreadPoolExecutor(max_workers=threads) if threads > 0 else None
+        self._max_pending = max(threads * 2, 1)
+        self._pending = []
+
+    def writable(self):
+        return True
+
+    def _compress(self, data: bytes) -> Tuple[bytes, int]:
+        return self._zstd.ZstdCompressor(level=self._level, write_content_size=True).compress(data), len(data)
+
+    def _emit(self, compressed: bytes, size: int):
+        self._fh.write(compressed)
+        self._frames.append((len(compressed), size))
+
+    def _submit(self, data: bytes):
+        if self._pool is None:
+            self._emit(*self._compress(data))
+            return
+        self._pending.append(self._pool.submit(self._compress, data))
+        while len(self._pending) >= self._max_pending:
+            self._emit(*self._pending.pop(0).result())
+
+    def write(self, b) -> int:
+        self._buffer += b
+        while len(self._buffer) >= self._frame_size:
+            self._submit(bytes(self._buffer[:self._frame_size]))
+            del self._buffer[:self._frame_size]
+        return len(b)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._buffer:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            for future in self._pending:
+                self._emit(*future.result())
+            self._pending = []
+
+            table = b"".join(struct.pack("<II", c, d) for c, d in self._frames)
+            table += struct.pack("<IBI", len(self._frames), 0, _SEEKABLE_MAGIC)
+            self._fh.write(struct.pack("<II", _SKIPPABLE_MAGIC, len(table)))
+            self._fh.write(table)
+        finally:
+            if self._pool is not None:
+                self._pool.shutdown()
+            self._fh.close()
+            super().close()
+
+
+class SeekableZstdReader(io.RawIOBase):
+    """
+    Random access reader for files written by SeekableZstdWriter.
+
+    Seeking decompresses only the frame containing the target offset, so
+    byte offsets recorded against the uncompressed stream keep working.
+    Wrap it in io.BufferedReader / io.TextIOWrapper for readline().
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self._decompressor = _zstd().ZstdDecompressor()
+        self._fh = open(path, 'rb')
+        self._frame_offsets, self._frame_starts = self._read_seek_table()
+        self._pos = 0
+        self._frame_index = -1
+        self._frame_data = b""
+
+    def _read_seek_table(self):
+        self._fh.seek(-_FOOTER_SIZE, os.SEEK_END)
+        num_frames, descriptor, magic = struct.unpack("<IBI", self._fh.read(_FOOTER_SIZE))
+        if magic != _SEEKABLE_MAGIC:
+            raise ValueError(f"{self._fh.name} is not a seekable zstd file")
+        entry_size = 12 if descriptor & 0x80 else 8
+        self._fh.seek(-(_FOOTER_SIZE + num_frames * entry_size), os.SEEK_END)
+        table = self._fh.read(num_frames * entry_size)
+
+        frame_offsets = [0]  # compressed offset of each frame
+        frame_starts = [0]   # uncompressed offset of each frame
+        for i in range(num_frames):
+            c, d = struct.unpack_from("<II", table, i * entry_size)
+            frame_offsets.append(frame_offsets[-1] + c)
+            frame_starts.append(frame_starts[-1] + d)
+        return frame_offsets, frame_starts
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self._pos = offset
+        elif whence == os.SEEK_CUR:
+            self._pos += offset
+        elif whence == os.SEEK_END:
+            self._pos = self._frame_starts[-1] + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        return self._pos
+
+    def _load_frame(self, index: int):
+        if index != self._frame_index:
+            start, end = self._frame_offsets[index], self._frame_offsets[index + 1]
+            self._fh.seek(start)
+            self._frame_data = self._decompressor.decompress(self._fh.read(end - start))
+            self._frame_index = index
+
+    def readinto(self, b) -> int:
+        if self._pos >= self._frame_starts[-1]:
+            return 0
+        index = bisect.bisect_right(self._frame_starts, self._pos) - 1
+        self._load_frame(index)
+        start = self._pos - self._frame_starts[index]
+        chunk = self._frame_data[start:start + len(b)]
+        b[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def close(self):
+        if not self.closed:
+            self._fh.close()
+        super().close()
+
+
+def open_seekable(path: str, mode: str = 'r'):
+    """
+    Opens a file for random access by uncompressed offset: plain files are
+    opened directly and `.zst` files through SeekableZstdReader.
+    """
+    path = resolve_path(path)
+    if path.endswith(".zst"):
+        fh = io.BufferedReader(SeekableZstdReader(path))
+        return fh if 'b' in mode else io.TextIOWrapper(fh, encoding='utf-8')
+    if path.endswith(".gz"):
+        raise ValueError(f"gzip files are not seekable, use .zst instead: {path}")
+    return open(path, 'rb' if 'b' in mode else 'r')
+
+
+def uncompressed_size(path: str) -> int:
+    """
+    Size of the decompressed contents of `path`. Plain files and seekable
+    zstd files are answered from metadata; other gzip / zstd files are
+    decompressed once to count their bytes.
+    """
+    path = resolve_path(path)
+    if path.endswith(".zst"):
+        try:
+            with SeekableZstdReader(path) as reader:
+                return reader.seek(0, os.SEEK_END)
+        except (ValueError, OSError):
+            pass  # a plain zstd stream without a seek table
+    elif not path.endswith(".gz"):
+        return os.path.getsize(path)
+    size = 0
+    with open_file(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(DEFAULT_FRAME_SIZE), b""):
+            size += len(chunk)
+    return size
@@ -0,0 +1,168 @@
+import hashlib
+import heapq
+import json
+import math
+import os
+import shutil
+import tempfile
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from compressed_io import open_file, uncompressed_size
+
+# Python keeps a line in memory as roughly twice its uncompressed size.
+_MEMORY_OVERHEAD = 2.0
+
+
+def content_key(record: dict) -> str:
+    """
+    128-bit digest of what a record trains on: the function text, the ligand
+    SMILES and the sequence. Records that differ only in uniprot_id or
+    ligand_id have the same key.
+    """
+    data = json.dumps([record["input"]["function_original"], record["input"]["ligand"], record["output"]])
+    return hashlib.blake2b(data.encode('utf-8'), digest_size=16).hexdigest()
+
+
+def _keyed_lines(paths: List[str]) -> Iterable[Tuple[int, str, str, str]]:
+    """
+    (line number, content key, uniprot_ids, line) for every record of the
+    concatenated JSONL files. uniprot_ids is comma-separated: a record that
+    was already collapsed (e.g. within one partition) brings all of its ids.
+    """
+    offset = 0
+    for path in paths:
+        line_no = -1
+        with open_file(path, 'r') as f:
+            for line_no, line in enumerate(f):
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                uniprot_ids = record.get("uniprot_ids", [record["uniprot_id"]])
+                yield offset + line_no, content_key(record), ",".join(uniprot_ids), line.rstrip('\n')
+        offset += line_no + 1
+
+
+def _collapse(entries: Iterable[Tuple[int, str, str, str]]) -> List[Tuple[int, str]]:
+    """
+    Groups entries by content key. Returns (line number of the first
+    occurrence, collapsed record) in first-occurrence order; the kept record
+    gains `multiplicity` and the `uniprot_ids` of all its copies.
+    """
+    groups = {}
+    for line_no, key, uniprot_ids, line in entries:
+        group = groups.get(key)
+        if group is None:
+            groups[key] = [line_no, line, uniprot_ids.split(",")]
+        else:
+            group[2].extend(uniprot_ids.split(","))
+
+    collapsed = []
+    for line_no, line, uniprot_ids in groups.values():
+        record = json.loads(line)
+        record["multiplicity"] = len(uniprot_ids)
+        record["uniprot_ids"] = uniprot_ids
+        collapsed.append((line_no, json.dumps(record)))
+    return collapsed
+
+
+def collapse_duplicates(in_path: Union[str, List[str]], out_path: str, memory_budget: int = 8 * 1024 ** 3,
+                        num_buckets: Optional[int] = None, threads: int = 0,
+                        tmp_dir: Optional[str] = None) -> Dict[str, int]:
+    """
+    Collapses records with identical (function text, ligand, sequence) into
+    one record with a `multiplicity` count and the list of source
+    `uniprot_ids`, keeping the order of first occurrences.
+
+    When the distinct records do not fit in `memory_budget`, the keyed
+    records are spilled to `num_buckets` temporary files by content key, so
+    all copies of a record land in the same bucket. Each bucket is collapsed
+    in memory on its own and the buckets are merged back by line number.
+
+    Input records that were collapsed before keep their copies: their
+    `uniprot_ids` are carried over, so collapsing per-partition outputs again
+    gives the same counts as collapsing everything at once.
+
+    Args:
+        in_path: JSONL file written by stage 5, or a list of files read as one.
+        out_path: Output JSONL; a .gz or .zst suffix compresses it.
+        memory_budget: Approximate bytes one bucket may take in memory.
+        num_buckets: Number of temporary buckets (overrides memory_budget).
+        threads: Threads used for .zst compression of the output.
+        tmp_dir: Where to put the temporary buckets (defaults to the output directory).
+
+    Returns:
+        dict with the number of input 'records', 'unique' records and 'num_buckets'.
+    """
+    in_paths = [in_path] if isinstance(in_path, str) else list(in_path)
+    if num_buckets is None:
+        input_size = sum(uncompressed_size(path) for path in in_paths)
+        num_buckets = max(1, math.ceil(input_size * _MEMORY_OVERHEAD / memory_budget))
+
+    total = 0
+    unique = 0
+    if num_buckets == 1:
+        def counted(entries):
+            nonlocal total
+            for entry in entries:
+                total += 1
+                yield entry
+
+        collapsed = _collapse(counted(_keyed_lines(in_paths)))
+        unique = len(collapsed)
+        with open_file(out_path, 'w', threads=threads) as out:
+            for _, line in collapsed:
+                out.write(line + '\n')
+        return {"records": total, "unique": unique, "num_buckets": num_buckets}
+
+    bucket_dir = tempfile.mkdtemp(prefix="dedup_", dir=tmp_dir or os.path.dirname(os.path.abspath(out_path)))
+    try:
+        # --- pass 1: spill keyed records by content key ---
+        buckets = [open(os.path.join(bucket_dir, f"{k:05d}.tsv"), 'w') for k in range(num_buckets)]
+        try:
+            for line_no, key, uniprot_ids, line in _keyed_lines(in_paths):
+                buckets[int(key[:8], 16) % num_buckets].write(f"{line_no}\t{key}\t{uniprot_ids}\t{line}\n")
+                total += 1
+        finally:
+            for b in buckets:
+                b.close()
+
+        # --- pass 2: collapse each bucket ---
+        for k in range(num_buckets):
+            bucket_path = os.path.join(bucket_dir, f"{k:05d}.tsv")
+            with open(bucket_path, 'r') as f:
+                entries = (line.rstrip('\n').split('\t', 3) for line in f)
+                collapsed = _collapse((int(n), key, uids, line) for n, key, uids, line in entries)
+            os.remove(bucket_path)
+            unique += len(collapsed)
+            with open(os.path.join(bucket_dir, f"{k:05d}.collapsed.tsv"), 'w') as f:
+                for line_no, line in collapsed:
+                    f.write(f"{line_no}\t{line}\n")
+
+        # --- pass 3: merge the buckets back into input order ---
+        parts = [open(os.path.join(bucket_dir, f"{k:05d}.collapsed.tsv"), 'r') for k in range(num_buckets)]
+        try:
+            with open_file(out_path, 'w', threads=threads) as out:
+                for entry in heapq.merge(*parts, key=lambda entry: int(entry.split('\t', 1)[0])):
+                    out.write(entry.split('\t', 1)[1])
+        finally:
+            for f in parts:
+                f.close()
+    finally:
+        shutil.rmtree(bucket_dir, ignore_errors=True)
+
+    return {"records": total, "unique": unique, "num_buckets": num_buckets}
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Collapse exact-duplicate records of stage 5 JSONL files.")
+    parser.add_argument("in_paths", nargs="+", help="Input files, read as one in the given order.")
+    parser.add_argument("out_path")
+    parser.add_argument("--memory-gb", type=float, default=8.0)
+    parser.add_argument("--num-buckets", type=int, default=None)
+    args = parser.parse_args()
+
+    stats = collapse_duplicates(args.in_paths, args.out_path, int(args.memory_gb * 1024 ** 3), args.num_buckets)
+    print(f"{stats['records']:,} records collapsed to {stats['unique']:,} unique records "
+          f"({stats['num_buckets']} buckets) in {args.out_path}")
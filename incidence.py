@@ -0,0 +1,144 @@
+import json
+from typing import Dict, Iterable, Set
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from cluster_stats import load_cluster_index, lookup_sorted, records_from_protein2ligand
+
+data_path = "/mnt/gemini/data/ramith/CMU-project/data/raw"
+
+
+class ClusterLigandIncidence:
+    """
+    Clusters x ligands matrix of pair counts: counts[c, l] is the number of
+    proteins in cluster c that bind ligand l.
+
+    Built once from the cluster index and the protein -> ligand mapping, it
+    turns the ligand questions of 4. split_ligands.py into sparse row and
+    column reductions over all clusters, e.g.
+
+        inc.ligand_set(val_clusters) - inc.ligand_set(test_clusters)   # ligands exclusive to val
+        inc.clusters_with_ligand("CHEBI_17568.sdf", among=train_clusters)
+        inc.overlap(val_clusters, test_clusters)
+    """
+
+    def __init__(self, counts: sp.csr_matrix, cluster_names: np.ndarray, ligand_names: np.ndarray,
+                 cluster_sizes: np.ndarray):
+        self.counts = counts.tocsr()
+        self.counts_csc = self.counts.tocsc()
+        self.cluster_names = np.asarray(cluster_names, dtype=object)
+        self.ligand_names = np.asarray(ligand_names, dtype=object)
+        self.cluster_sizes = np.asarray(cluster_sizes)
+        self._cluster_index = {name: i for i, name in enumerate(self.cluster_names)}
+        self._ligand_index = {name: i for i, name in enumerate(self.ligand_names)}
+
+    @classmethod
+    def build(cls, cluster_mapping_file: str, protein2ligand: Dict[str, list]) -> "ClusterLigandIncidence":
+        cluster_names, protein_ids, protein_cluster = load_cluster_index(cluster_mapping_file)
+        cluster_sizes = np.bincount(protein_cluster, minlength=len(cluster_names))
+
+        pairs = records_from_protein2ligand(protein2ligand)
+        pos = lookup_sorted(protein_ids, pairs["uniprot_id"].to_numpy(dtype='S'))
+        in_cluster = pos >= 0
+        ligand_codes, ligand_names = pd.factorize(pairs["ligand_id"][in_cluster])
+
+        counts = sp.coo_matrix(
+            (np.ones(len(ligand_codes), dtype=np.int32), (protein_cluster[pos[in_cluster]], ligand_codes)),
+            shape=(len(cluster_names), len(ligand_names)),
+        ).tocsr()
+        counts.sum_duplicates()
+        return cls(counts, cluster_names, ligand_names, cluster_sizes)
+
+    def save(self, path_prefix: str):
+        sp.save_npz(f"{path_prefix}.counts.npz", self.counts)
+        np.savez(f"{path_prefix}.names.npz", cluster_names=self.cluster_names.astype(str),
+                 ligand_names=self.ligand_names.astype(str), cluster_sizes=self.cluster_sizes)
+
+    @classmethod
+    def load(cls, path_prefix: str) -> "ClusterLigandIncidence":
+        try:
+            counts = sp.load_npz(f"{path_prefix}.counts.npz")
+            with np.load(f"{path_prefix}.names.npz") as names:
+                return cls(counts, names["cluster_names"], names["ligand_names"], names["cluster_sizes"])
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Incidence matrix not found: {path_prefix}.*.npz")
+
+    # --- index helpers ---
+
+    def cluster_mask(self, cluster_ids: Iterable[str]) -> np.ndarray:
+        """Boolean mask over all clusters; unknown cluster IDs are ignored."""
+        mask = np.zeros(len(self.cluster_names), dtype=bool)
+        mask[[self._cluster_index[c] for c in cluster_ids if c in self._cluster_index]] = True
+        return mask
+
+    def _rows(self, clusters) -> np.ndarray:
+        if isinstance(clusters, np.ndarray) and clusters.dtype == bool:
+            return clusters.astype(np.int32)
+        return self.cluster_mask(clusters).astype(np.int32)
+
+    # --- row reductions ---
+
+    def ligand_pair_counts(self, clusters) -> np.ndarray:
+        """Pair counts per ligand summed over `clusters` (cluster IDs or a cluster mask)."""
+        return self.counts.T @ self._rows(clusters)
+
+    def ligand_counts(self, clusters) -> Dict[str, int]:
+        """{ligand: number of proteins binding it} within `clusters`."""
+        totals = self.ligand_pair_counts(clusters)
+        nonzero = np.flatnonzero(totals)
+        return dict(zip(self.ligand_names[nonzero].tolist(), totals[nonzero].tolist()))
+
+    def ligand_set(self, clusters) -> Set[str]:
+        """Ligands bound by at least one protein in `clusters`."""
+        return set(self.ligand_names[self.ligand_pair_counts(clusters) > 0].tolist())
+
+    def overlap(self, clusters_a, clusters_b) -> Set[str]:
+        """Ligands that occur in both cluster sets."""
+        both = (self.ligand_pair_counts(clusters_a) > 0) & (self.ligand_pair_counts(clusters_b) > 0)
+        return set(self.ligand_names[both].tolist())
+
+    def exclusive_ligands(self, clusters, others) -> Set[str]:
+        """Ligands that occur in `clusters` but nowhere in `others`."""
+        only = (self.ligand_pair_counts(clusters) > 0) & (self.ligand_pair_counts(others) == 0)
+        return set(self.ligand_names[only].tolist())
+
+    # --- column reductions ---
+
+    def clusters_with_ligand(self, ligand_id: str, among=None) -> Dict[str, int]:
+        """{cluster: pair count} of the clusters containing `ligand_id`, optionally restricted to `among`."""
+        column = self._ligand_index.get(ligand_id)
+        if column is None:
+            return {}
+        start, end = self.counts_csc.indptr[column], self.counts_csc.indptr[column + 1]
+        rows = self.counts_csc.indices[start:end]
+        values = self.counts_csc.data[start:end]
+        if among is not None:
+            keep = self._rows(among)[rows] > 0
+            rows, values = rows[keep], values[keep]
+        return dict(zip(self.cluster_names[rows].tolist(), values.tolist()))
+
+    def cluster_counts(self, ligand_ids: Iterable[str]) -> np.ndarray:
+        """Pair counts per cluster summed over `ligand_ids`."""
+        columns = np.zeros(len(self.ligand_names), dtype=np.int32)
+        columns[[self._ligand_index[l] for l in ligand_ids if l in self._ligand_index]] = 1
+        return self.counts @ columns
+
+    def binary(self) -> sp.csr_matrix:
+        """0/1 version of the matrix (cluster contains ligand)."""
+        return (self.counts > 0).astype(np.int32).tocsr()
+
+
+if __name__ == '__main__':
+    import sys
+    from compressed_io import open_file
+
+    # usage: python incidence.py [out_prefix]   (builds and saves the matrix)
+    out_prefix = sys.argv[1] if len(sys.argv) > 1 else "cluster_ligand_incidence"
+    with open_file(f"{data_path}/data/protein2ligand_id.json", 'r') as f:
+        protein2ligand = json.load(f)
+    inc = ClusterLigandIncidence.build(f"{data_path}/data/clusterRes_cluster.tsv", protein2ligand)
+    inc.save(out_prefix)
+    print(f"{inc.counts.shape[0]:,} clusters x {inc.counts.shape[1]:,} ligands, "
+          f"{inc.counts.nnz:,} nonzeros, {inc.counts.sum():,} pairings saved to {out_prefix}.*.npz")
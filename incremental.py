@@ -0,0 +1,387 @@
+import hashlib
+import json
+import os
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+import ijson
+import numpy as np
+
+from cluster_stats import lookup_sorted
+from compressed_io import COMPRESSED_SUFFIXES, open_file, resolve_path
+
+data_path = "/mnt/gemini/data/ramith/CMU-project/data/raw"
+
+# manifest name -> raw file (relative to data_path/data)
+# (ligands and texts come first: they decide which proteins and sequences run_delta has to keep)
+SOURCES = {
+    "ligand2smiles": "ligand2smiles.json",
+    "protein2ligand": "protein2ligand_id.json",
+    "uniprot2text": "uniprot2text.json",
+    "uniprot2seq": "uniprot2seq.json",
+    "uniref50": "uniref50.jsonl",
+}
+
+Fingerprint = Tuple[np.ndarray, np.ndarray]  # (sorted ids as bytes, uint64 value hashes)
+
+PROTEIN_SOURCES = ("protein2ligand", "uniprot2text", "uniprot2seq", "uniref50")
+
+_BATCH_SIZE = 65536
+
+
+def hash_value(value) -> int:
+    """64-bit content hash of a raw value (a sequence, a text or a ligand list)."""
+    data = value.encode('utf-8') if isinstance(value, str) else json.dumps(value).encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+def strip_sdf(ligand_id: str) -> str:
+    return ligand_id[:-4] if ligand_id.endswith('.sdf') else ligand_id
+
+
+def _iter_items(path: str) -> Iterable[Tuple[str, any]]:
+    base = path
+    for suffix in COMPRESSED_SUFFIXES:
+        if base.endswith(suffix):
+            base = base[:-len(suffix)]
+    if base.endswith(".jsonl"):
+        with open_file(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    obj = json.loads(line)
+                    if isinstance(obj, dict):
+                        yield from obj.items()
+    else:
+        with open_file(path, 'rb') as f:
+            yield from ijson.kvitems(f, '')
+
+
+def _sorted_fingerprint(ids: np.ndarray, hashes: np.ndarray) -> Fingerprint:
+    order = np.argsort(ids, kind='stable')
+    ids, hashes = ids[order], hashes[order]
+    # keep the first occurrence of duplicated keys, like make_fasta does
+    first = np.r_[True, ids[1:] != ids[:-1]] if len(ids) else np.zeros(0, dtype=bool)
+    return ids[first], hashes[first]
+
+
+def fingerprint_source(path: str, previous: Optional[Fingerprint] = None,
+                       keep_ids: Optional[np.ndarray] = None,
+                       stored_ids: Optional[np.ndarray] = None,
+                       keep_if: Optional[Callable[[any], bool]] = None) -> Tuple[Fingerprint, Dict[str, any]]:
+    """
+    Streams a raw {id: value} JSON / JSONL file once and hashes every value.
+    Keys and hashes are collected as numpy arrays per batch, not as Python
+    objects, so even uniref50 fits in a few bytes per key.
+
+    Args:
+        path: Raw file.
+        previous: Fingerprint of the same source from the previous run.
+        keep_ids: Sorted bytes array of keys whose values may be kept.
+        stored_ids: Sorted bytes array of keys the previous run already
+                    exported; their values are only kept if they are new to
+                    this source or their hash differs from `previous`.
+        keep_if: Also keep the values for which keep_if(value) is true.
+
+    Returns:
+        (fingerprint, kept_values) where kept_values holds the values selected
+        by `keep_ids` / `stored_ids` and `keep_if`.
+    """
+    id_chunks = []
+    hash_chunks = []
+    kept_values = {}
+    batch = []
+
+    def flush():
+        batch_ids = np.asarray([key for key, _, _ in batch], dtype='S')
+        batch_hashes = np.asarray([h for _, h, _ in batch], dtype=np.uint64)
+        id_chunks.append(batch_ids)
+        hash_chunks.append(batch_hashes)
+        keep = np.zeros(len(batch), dtype=bool)
+        if keep_ids is not None and len(keep_ids):
+            keep = lookup_sorted(keep_ids, batch_ids) >= 0
+            if stored_ids is not None and len(stored_ids):
+                changed = np.ones(len(batch), dtype=bool)
+                if previous is not None:
+                    pos = lookup_sorted(previous[0], batch_ids)
+                    changed = (pos < 0) | (previous[1][np.maximum(pos, 0)] != batch_hashes)
+                keep &= changed | (lookup_sorted(stored_ids, batch_ids) < 0)
+        if keep_if is not None:
+            keep |= np.fromiter((keep_if(value) for _, _, value in batch), dtype=bool, count=len(batch))
+        for k in np.flatnonzero(keep).tolist():
+            key, _, value = batch[k]
+            kept_values.setdefault(key, value)
+        batch.clear()
+
+    for key, value in _iter_items(path):
+        batch.append((key, hash_value(value), value))
+        if len(batch) == _BATCH_SIZE:
+            flush()
+    if batch:
+        flush()
+    ids = np.concatenate(id_chunks) if id_chunks else np.zeros(0, dtype='S1')
+    hashes = np.concatenate(hash_chunks) if hash_chunks else np.zeros(0, dtype=np.uint64)
+    del id_chunks[:], hash_chunks[:]
+    return _sorted_fingerprint(ids, hashes), kept_values
+
+
+def diff_fingerprints(old: Fingerprint, new: Fingerprint) -> Dict[str, np.ndarray]:
+    """Returns the added, removed and changed keys between two fingerprints."""
+    old_ids, old_hashes = old
+    new_ids, new_hashes = new
+    pos = lookup_sorted(old_ids, new_ids)
+    common = pos >= 0
+    return {
+        "added": new_ids[~common],
+        "removed": old_ids[lookup_sorted(new_ids, old_ids) < 0],
+        "changed": new_ids[common][old_hashes[pos[common]] != new_hashes[common]],
+    }
+
+
+def select_uniprot_ids(fingerprints: Dict[str, Fingerprint]) -> np.ndarray:
+    """The stage 1 selection: (ligand & text) & (seq | uniref50), as a sorted bytes array."""
+    ligand_text = np.intersect1d(fingerprints["protein2ligand"][0], fingerprints["uniprot2text"][0], assume_unique=True)
+    with_seq = np.intersect1d(ligand_text, fingerprints["uniprot2seq"][0], assume_unique=True)
+    with_uniref = np.intersect1d(ligand_text, fingerprints["uniref50"][0], assume_unique=True)
+    return np.union1d(with_seq, with_uniref)
+
+
+def sequence_hashes(fingerprints: Dict[str, Fingerprint], ids: np.ndarray) -> np.ndarray:
+    """Hash of the sequence each protein is exported with (uniprot2seq first, then uniref50); 0 if none."""
+    result = np.zeros(len(ids), dtype=np.uint64)
+    found = np.zeros(len(ids), dtype=bool)
+    for source in ("uniprot2seq", "uniref50"):
+        source_ids, source_hashes = fingerprints[source]
+        pos = lookup_sorted(source_ids, ids)
+        hit = (pos >= 0) & ~found
+        result[hit] = source_hashes[pos[hit]]
+        found |= hit
+    return result
+
+
+def save_manifest(out_dir: str, fingerprints: Dict[str, Fingerprint], selected: np.ndarray):
+    os.makedirs(out_dir, exist_ok=True)
+    for name, (ids, hashes) in fingerprints.items():
+        np.savez(os.path.join(out_dir, f"{name}.npz"), ids=ids, hashes=hashes)
+    np.save(os.path.join(out_dir, "selected_ids.npy"), selected)
+    with open(os.path.join(out_dir, "manifest.json"), 'w') as f:
+        json.dump({
+            "sources": {name: {"file": SOURCES[name], "keys": len(ids)} for name, (ids, _) in fingerprints.items()},
+            "selected": len(selected),
+        }, f, indent=2)
+
+
+def load_manifest(manifest_dir: str) -> Tuple[Dict[str, Fingerprint], np.ndarray]:
+    fingerprints = {}
+    for name in SOURCES:
+        path = os.path.join(manifest_dir, f"{name}.npz")
+        if name == "ligand2smiles" and not os.path.exists(path):
+            continue  # manifests written before ligands were tracked
+        try:
+            with np.load(path) as data:
+                fingerprints[name] = (data["ids"], data["hashes"])
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Manifest file not found: {path}")
+    return fingerprints, np.load(os.path.join(manifest_dir, "selected_ids.npy"))
+
+
+def load_cluster_rows(cluster_mapping_file: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Returns the (cluster, member) columns of clusterRes_cluster.tsv as bytes arrays."""
+    clusters = []
+    members = []
+    with open_file(cluster_mapping_file, 'r') as f:
+        for line in f:
+            row = line.rstrip('\n').split('\t')
+            if len(row) >= 2:
+                clusters.append(row[0])
+                members.append(row[1])
+    return np.asarray(clusters, dtype='S'), np.asarray(members, dtype='S')
+
+
+def assign_to_existing_clusters(new_ids: np.ndarray, clusters: np.ndarray, members: np.ndarray,
+                                old_fingerprints: Dict[str, Fingerprint],
+                                new_fingerprints: Dict[str, Fingerprint]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Assigns proteins that are new to the selection to existing clusters.
+
+    A protein keeps its cluster if it is already a member in the stored
+    mapping (e.g. it was deselected and came back); otherwise it joins the
+    cluster of a stored member with an identical sequence. The rest cannot
+    be placed without re-running mmseqs and are returned as unassigned.
+
+    Returns:
+        (assigned_clusters, unassigned_mask) aligned with new_ids;
+        assigned_clusters is b"" where unassigned_mask is True.
+    """
+    order = np.argsort(members, kind='stable')
+    sorted_members, sorted_clusters = members[order], clusters[order]
+
+    assigned = np.full(len(new_ids), b"", dtype=clusters.dtype if len(clusters) else 'S1')
+    pos = lookup_sorted(sorted_members, new_ids)
+    known = pos >= 0
+    assigned[known] = sorted_clusters[pos[known]]
+
+    member_hashes = sequence_hashes(old_fingerprints, sorted_members)
+    hash_order = np.argsort(member_hashes, kind='stable')
+    sorted_hashes = member_hashes[hash_order]
+    new_hashes = sequence_hashes(new_fingerprints, new_ids)
+
+    candidates = ~known & (new_hashes != 0)
+    if len(sorted_hashes):
+        hpos = np.minimum(np.searchsorted(sorted_hashes, new_hashes), len(sorted_hashes) - 1)
+        same_seq = candidates & (sorted_hashes[hpos] == new_hashes)
+        assigned[same_seq] = sorted_clusters[hash_order[hpos[same_seq]]]
+        known |= same_seq
+    return assigned, ~known
+
+
+def record_uniprot_id(line: str) -> Optional[str]:
+    """Extracts uniprot_id from a stage 5 record without parsing the whole line."""
+    i = line.rfind('"uniprot_id": "')
+    if i >= 0:
+        j = line.find('"', i + 15)
+        return line[i + 15:j]
+    return json.loads(line).get("uniprot_id")
+
+
+def patch_jsonl(path: str, drop_ids: Set[str], new_lines: List[str]) -> Tuple[int, int]:
+    """
+    Rewrites a stage 5 output without the records of `drop_ids` and with
+    `new_lines` appended, without re-tokenizing anything.
+
+    Returns:
+        (records dropped, records added)
+    """
+    directory, name = os.path.split(path)
+    tmp_path = os.path.join(directory, f".patch-{name}")
+    dropped = 0
+    with open_file(path, 'r') as f_in, open_file(tmp_path, 'w') as f_out:
+        for line in f_in:
+            if not line.strip():
+                continue
+            if record_uniprot_id(line) in drop_ids:
+                dropped += 1
+                continue
+            f_out.write(line)
+        f_out.writelines(new_lines)
+    os.replace(tmp_path, path)
+    return dropped, len(new_lines)
+
+
+def _write_ids(path: str, ids: Iterable):
+    with open(path, 'w') as f:
+        for uid in ids:
+            f.write((uid.decode() if isinstance(uid, bytes) else uid) + "\n")
+
+
+def run_delta(previous_dir: Optional[str], out_dir: str, cluster_mapping_file: str, raw_dir: str):
+    """
+    Fingerprints a data drop and, given the previous run's manifest, works
+    out what stage 2 and stage 5 have to redo. See the README for the files
+    written to `out_dir`.
+    """
+    old_fingerprints, old_selected = load_manifest(previous_dir) if previous_dir else ({}, None)
+
+    fingerprints = {}
+    kept_values = {}
+    changed_ligands = set()
+    for name, file_name in SOURCES.items():
+        keep_ids = None
+        stored_ids = None
+        keep_if = None
+        if name in ("uniprot2seq", "uniref50") and old_selected is not None:
+            # candidates for the new selection: proteins entering it need their sequence
+            # even if it did not change, proteins already in it only if it changed
+            keep_ids = np.intersect1d(fingerprints["protein2ligand"][0], fingerprints["uniprot2text"][0],
+                                      assume_unique=True)
+            stored_ids = old_selected
+        if name == "protein2ligand" and changed_ligands:
+            # proteins with a ligand whose SMILES was added, removed or changed
+            keep_if = lambda ligands: any(strip_sdf(lig) in changed_ligands for lig in ligands)
+        # only sequences are read back (for delta_sequences.fasta); for
+        # protein2ligand only the keys of the proteins caught by keep_if matter
+        fingerprints[name], kept_values[name] = fingerprint_source(
+            resolve_path(os.path.join(raw_dir, file_name)), old_fingerprints.get(name), keep_ids, stored_ids,
+            keep_if=keep_if)
+        print(f"{name}: {len(fingerprints[name][0]):,} keys")
+        if name == "ligand2smiles" and name in old_fingerprints:
+            ligand_diff = diff_fingerprints(old_fingerprints[name], fingerprints[name])
+            changed_ligands = set(np.concatenate(list(ligand_diff.values())).astype(str).tolist())
+
+    selected = select_uniprot_ids(fingerprints)
+    save_manifest(out_dir, fingerprints, selected)
+    _write_ids(os.path.join(out_dir, "selected_uniprot_ids.txt"), selected)
+    print(f"Selected uniprot ids: {len(selected):,}")
+
+    if previous_dir is None:
+        print(f"No previous manifest given; baseline manifest saved to {out_dir}")
+        return
+
+    # --- what changed within the selection ---
+    selection_diff = diff_fingerprints((old_selected, np.zeros(len(old_selected), dtype=np.uint64)),
+                                       (selected, np.zeros(len(selected), dtype=np.uint64)))
+    changed = np.zeros(0, dtype='S')
+    for name in PROTEIN_SOURCES:
+        changed = np.union1d(changed, diff_fingerprints(old_fingerprints[name], fingerprints[name])["changed"])
+    ligand_affected = np.asarray(sorted(kept_values["protein2ligand"]), dtype='S')
+    changed = np.intersect1d(np.union1d(changed, ligand_affected), selected)
+    removed = selection_diff["removed"]
+    added = selection_diff["added"]
+    affected = np.union1d(np.union1d(added, removed), changed)
+
+    # --- stage 2: only new or changed sequences ---
+    seq_ids = fingerprints["uniprot2seq"][0]
+    delta_written = 0
+    with open(os.path.join(out_dir, "delta_sequences.fasta"), 'w') as fasta_out:
+        wanted = set(np.union1d(added, changed).astype(str).tolist())
+        for name in ("uniprot2seq", "uniref50"):
+            for uniprot_id, sequence in kept_values[name].items():
+                if uniprot_id not in wanted:
+                    continue
+                if name == "uniref50" and lookup_sorted(seq_ids, [uniprot_id])[0] >= 0:
+                    continue  # uniprot2seq takes precedence, as in make_fasta
+                fasta_out.write(f">{uniprot_id}\n{sequence}\n")
+                wanted.discard(uniprot_id)
+                delta_written += 1
+
+    # --- clusters: keep the stored mapping, place new proteins where possible ---
+    clusters, members = load_cluster_rows(cluster_mapping_file)
+    assigned, unassigned = assign_to_existing_clusters(added, clusters, members, old_fingerprints, fingerprints)
+    keep = lookup_sorted(np.sort(removed), members) < 0
+    with open(os.path.join(out_dir, "clusterRes_cluster.tsv"), 'w') as f:
+        for cluster_id, member in zip(clusters[keep].astype(str), members[keep].astype(str)):
+            f.write(f"{cluster_id}\t{member}\n")
+        already = lookup_sorted(np.sort(members), added) >= 0
+        for cluster_id, member in zip(assigned[~unassigned & ~already].astype(str), added[~unassigned & ~already].astype(str)):
+            f.write(f"{cluster_id}\t{member}\n")
+
+    _write_ids(os.path.join(out_dir, "affected_uniprot_ids.txt"), affected)
+    _write_ids(os.path.join(out_dir, "removed_uniprot_ids.txt"), removed)
+    _write_ids(os.path.join(out_dir, "unassigned_uniprot_ids.txt"), added[unassigned])
+
+    summary = {
+        "added": len(added),
+        "removed": len(removed),
+        "changed": len(changed),
+        "changed_ligands": len(changed_ligands),
+        "affected": len(affected),
+        "assigned_to_existing_clusters": int((~unassigned).sum()),
+        "unassigned": int(unassigned.sum()),
+        "delta_sequences": delta_written,
+    }
+    with open(os.path.join(out_dir, "delta.json"), 'w') as f:
+        json.dump(summary, f, indent=2)
+    for key, value in summary.items():
+        print(f"{key}: {value:,}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Diff a new UniProt/ChEBI drop against the previous run's manifest.")
+    parser.add_argument("out_dir", help="Directory for the new manifest and the delta files.")
+    parser.add_argument("--previous", default=None, help="Manifest directory of the previous run.")
+    parser.add_argument("--raw-dir", default=f"{data_path}/data", help="Directory with the raw input files.")
+    parser.add_argument("--cluster-mapping", default=f"{data_path}/data/clusterRes_cluster.tsv",
+                        help="clusterRes_cluster.tsv of the previous run.")
+    args = parser.parse_args()
+
+    run_delta(args.previous, args.out_dir, args.cluster_mapping, args.raw_dir)
@@ -0,0 +1,306 @@
+import json
+import os
+from multiprocessing import Pool
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from cluster_stats import load_cluster_index, lookup_sorted
+from compressed_io import open_file
+from residue_vocab import ResidueVocab
+
+data_path = "/mnt/gemini/data/ramith/CMU-project/data/raw"
+
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+_EMPTY = np.iinfo(np.uint32).max
+_CHUNK_SEQUENCES = 2000
+_KMER_BATCH = 1 << 16
+_PAIR_BATCH = 1 << 20
+
+
+def read_fasta(path: str) -> Iterable[Tuple[str, str]]:
+    """(id, sequence) pairs of a (possibly compressed) FASTA file; the id is the first word of the header."""
+    with open_file(path, 'r') as f:
+        name, parts = None, []
+        for line in f:
+            line = line.strip()
+            if line.startswith(">"):
+                if name is not None:
+                    yield name, "".join(parts)
+                name, parts = line[1:].split()[0], []
+            elif line:
+                parts.append(line)
+        if name is not None:
+            yield name, "".join(parts)
+
+
+class MinHasher:
+    """
+    MinHash signatures over residue k-mers.
+
+    Each k-mer is packed into one integer (5 bits per residue ID), and
+    permutation i is the multiply-shift hash ((a_i * x + b_i) mod 2^64) >> 32
+    with odd a_i, so a whole batch of k-mers is hashed under all
+    permutations with one broadcast multiply.
+    """
+
+    def __init__(self, k: int = 5, num_perm: int = 64, seed: int = 42, vocab: Optional[ResidueVocab] = None):
+        if not 1 <= k <= 12:
+            raise ValueError(f"k must be between 1 and 12, got {k}")
+        self.k = k
+        self.num_perm = num_perm
+        self.vocab = vocab or ResidueVocab()
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(0, np.iinfo(np.uint64).max, size=num_perm, dtype=np.uint64, endpoint=True) | np.uint64(1)
+        self.b = rng.integers(0, np.iinfo(np.uint64).max, size=num_perm, dtype=np.uint64, endpoint=True)
+        self._weights = (np.uint64(32) ** np.arange(k - 1, -1, -1, dtype=np.uint64))
+
+    def kmers(self, sequence: str) -> np.ndarray:
+        ids = self.vocab.encode(sequence).astype(np.uint64)
+        if len(ids) < self.k:
+            return np.zeros(0, dtype=np.uint64)
+        return np.unique(sliding_window_view(ids, self.k) @ self._weights)
+
+    def signatures(self, sequences: List[str]) -> np.ndarray:
+        """uint32 signatures of shape (len(sequences), num_perm); rows of sequences shorter than k are all 0xFFFFFFFF."""
+        signatures = np.full((len(sequences), self.num_perm), _EMPTY, dtype=np.uint32)
+        kmers = [self.kmers(s) for s in sequences]
+        lengths = np.fromiter((len(x) for x in kmers), dtype=np.int64, count=len(kmers))
+        owners = np.repeat(np.arange(len(sequences)), lengths)
+        values = np.concatenate(kmers) if kmers else np.zeros(0, dtype=np.uint64)
+
+        with np.errstate(over='ignore'):
+            for start in range(0, len(values), _KMER_BATCH):
+                x = values[start:start + _KMER_BATCH, None]
+                hashed = ((x * self.a + self.b) >> np.uint64(32)).astype(np.uint32)
+                batch_owners = owners[start:start + _KMER_BATCH]
+                starts = np.flatnonzero(np.r_[True, batch_owners[1:] != batch_owners[:-1]])
+                rows = batch_owners[starts]
+                # running minimum per sequence: batches can split one sequence's k-mers
+                signatures[rows] = np.minimum(signatures[rows], np.minimum.reduceat(hashed, starts, axis=0))
+        return signatures
+
+
+_worker_hasher: Optional[MinHasher] = None
+
+
+def _init_worker(k: int, num_perm: int, seed: int):
+    global _worker_hasher
+    _worker_hasher = MinHasher(k, num_perm, seed)
+
+
+def _signature_chunk(sequences: List[str]) -> np.ndarray:
+    return _worker_hasher.signatures(sequences)
+
+
+def _chunks(records: Iterable[Tuple[str, str]], ids: List[str]) -> Iterable[List[str]]:
+    chunk = []
+    for name, sequence in records:
+        ids.append(name)
+        chunk.append(sequence)
+        if len(chunk) == _CHUNK_SEQUENCES:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def build_signatures(fasta_path: str, out_prefix: str, k: int = 5, num_perm: int = 64, seed: int = 42,
+                     processes: int = os.cpu_count() or 1) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the MinHash signature of every FASTA sequence on `processes`
+    processes and saves `<out_prefix>.sig.npy` (uint32, sequences x num_perm)
+    and `<out_prefix>.ids.npy`, both in FASTA order, plus the parameters in
+    `<out_prefix>.params.json` (see load_signatures).
+    """
+    ids = []
+    parts = []
+    with Pool(processes, initializer=_init_worker, initargs=(k, num_perm, seed)) as pool:
+        for i, part in enumerate(pool.imap(_signature_chunk, _chunks(read_fasta(fasta_path), ids), chunksize=1)):
+            parts.append(part)
+            if (i + 1) % 100 == 0:
+                print(f"{(i + 1) * _CHUNK_SEQUENCES:,} signatures")
+    signatures = np.concatenate(parts) if parts else np.zeros((0, num_perm), dtype=np.uint32)
+    ids = np.asarray(ids, dtype='S')
+    np.save(f"{out_prefix}.sig.npy", signatures)
+    np.save(f"{out_prefix}.ids.npy", ids)
+    with open(f"{out_prefix}.params.json", 'w') as f:
+        json.dump({"k": k, "num_perm": num_perm, "seed": seed}, f)
+    return ids, signatures
+
+
+def load_signatures(prefix: str, k: int, num_perm: int, seed: int) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+    """
+    Loads signatures saved by build_signatures (memory-mapped), or returns
+    None if there are none or they were built with different parameters.
+    """
+    if not os.path.exists(f"{prefix}.sig.npy"):
+        return None
+    params = {"k": k, "num_perm": num_perm, "seed": seed}
+    try:
+        with open(f"{prefix}.params.json", 'r') as f:
+            saved = json.load(f)
+    except FileNotFoundError:
+        saved = None
+    if saved != params:
+        print(f"{prefix}.sig.npy was built with {saved}, not {params}; rebuilding")
+        return None
+    return np.load(f"{prefix}.ids.npy"), np.load(f"{prefix}.sig.npy", mmap_mode='r')
+
+
+def band_keys(band_columns: np.ndarray) -> np.ndarray:
+    """One 64-bit key per signature from the columns of one LSH band."""
+    key = np.zeros(len(band_columns), dtype=np.uint64)
+    with np.errstate(over='ignore'):
+        for column in range(band_columns.shape[1]):
+            key = key * _MIX + band_columns[:, column].astype(np.uint64)
+    return key
+
+
+def candidate_pairs(signatures: np.ndarray, queries: np.ndarray, targets: np.ndarray, bands: int,
+                    max_bucket: int = 1000) -> np.ndarray:
+    """
+    LSH banding: (query, target) signature row pairs that agree on all rows
+    of at least one band. Buckets are truncated to `max_bucket` targets so
+    low-complexity sequences cannot blow up the candidate set.
+
+    Returns:
+        int64 array of shape (pairs, 2).
+    """
+    rows = signatures.shape[1] // bands
+    found = []
+    for band in range(bands):
+        # gather only this band's columns, not whole signature rows
+        columns = slice(band * rows, (band + 1) * rows)
+        target_keys = band_keys(signatures[targets, columns])
+        order = np.argsort(target_keys, kind='stable')
+        sorted_keys = target_keys[order]
+        query_keys = band_keys(signatures[queries, columns])
+        lo = np.searchsorted(sorted_keys, query_keys, 'left')
+        counts = np.minimum(np.searchsorted(sorted_keys, query_keys, 'right') - lo, max_bucket)
+
+        query_index = np.repeat(np.arange(len(queries)), counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        target_index = order[np.repeat(lo, counts) + within]
+        found.append(queries[query_index].astype(np.int64) * len(signatures) + targets[target_index])
+        found = [np.unique(np.concatenate(found))]
+    pairs = found[0] if found else np.zeros(0, dtype=np.int64)
+    return np.stack([pairs // len(signatures), pairs % len(signatures)], axis=1)
+
+
+def estimate_jaccard(signatures: np.ndarray, pairs: np.ndarray) -> np.ndarray:
+    jaccard = np.empty(len(pairs), dtype=np.float32)
+    for start in range(0, len(pairs), _PAIR_BATCH):
+        batch = pairs[start:start + _PAIR_BATCH]
+        jaccard[start:start + _PAIR_BATCH] = (signatures[batch[:, 0]] == signatures[batch[:, 1]]).mean(axis=1)
+    return jaccard
+
+
+def protein_splits(ids: np.ndarray, cluster_mapping_file: str, split_dir: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Cluster name and split ("train", "val", "test" or "") of every protein in `ids`."""
+    cluster_names, protein_ids, protein_cluster = load_cluster_index(cluster_mapping_file)
+    split_of_cluster = pd.Series("", index=cluster_names, dtype=object)
+    for split in ("train", "val", "test"):
+        with open(os.path.join(split_dir, f"{split}_clusters.txt"), 'r') as f:
+            members = [line.strip() for line in f if line.strip()]
+        split_of_cluster[split_of_cluster.index.isin(members)] = split
+
+    pos = lookup_sorted(protein_ids, ids)
+    clusters = np.where(pos >= 0, cluster_names[protein_cluster[np.maximum(pos, 0)]], "")
+    splits = np.where(pos >= 0, split_of_cluster.to_numpy()[protein_cluster[np.maximum(pos, 0)]], "")
+    return clusters.astype(object), splits.astype(object)
+
+
+def find_leakage(ids: np.ndarray, signatures: np.ndarray, clusters: np.ndarray, splits: np.ndarray,
+                 bands: int = 16, threshold: float = 0.5, max_bucket: int = 1000) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    Val/test proteins whose estimated k-mer Jaccard similarity to a train
+    protein is at least `threshold`.
+
+    With b bands of r rows, a pair with Jaccard s becomes a candidate with
+    probability 1 - (1 - s^r)^b; the default 16 x 4 bands of 64
+    permutations catch s = 0.5 with probability ~0.65 and s = 0.6 with ~0.9.
+
+    Returns:
+        (pairs, clusters): one row per leaking (eval protein, train protein)
+        pair, and a per val/test cluster summary.
+    """
+    if signatures.shape[1] % bands:
+        raise ValueError(f"{signatures.shape[1]} permutations cannot be split into {bands} bands")
+    valid = (signatures != _EMPTY).any(axis=1)
+    queries = np.flatnonzero(valid & np.isin(splits, ["val", "test"]))
+    targets = np.flatnonzero(valid & (splits == "train"))
+
+    pairs = candidate_pairs(signatures, queries, targets, bands, max_bucket)
+    jaccard = estimate_jaccard(signatures, pairs)
+    keep = jaccard >= threshold
+    pairs, jaccard = pairs[keep], jaccard[keep]
+    print(f"{len(queries):,} val/test and {len(targets):,} train proteins: "
+          f"{keep.size:,} candidate pairs, {len(pairs):,} at Jaccard >= {threshold}")
+
+    decoded = np.char.decode(ids, 'ascii') if ids.dtype.kind == 'S' else ids
+    pair_table = pd.DataFrame({
+        "protein_id": decoded[pairs[:, 0]],
+        "cluster_id": clusters[pairs[:, 0]],
+        "split": splits[pairs[:, 0]],
+        "train_protein_id": decoded[pairs[:, 1]],
+        "train_cluster_id": clusters[pairs[:, 1]],
+        "jaccard": jaccard,
+    }).sort_values(["split", "cluster_id", "jaccard"], ascending=[True, True, False], ignore_index=True)
+
+    members = pd.DataFrame({"cluster_id": clusters[queries], "split": splits[queries]})
+    summary = members.groupby(["cluster_id", "split"]).size().rename("members").to_frame()
+    grouped = pair_table.groupby(["cluster_id", "split"])
+    summary["leaking_members"] = grouped["protein_id"].nunique()
+    summary["max_jaccard"] = grouped["jaccard"].max()
+    summary["train_clusters"] = grouped["train_cluster_id"].nunique()
+    summary["top_train_cluster"] = grouped["train_cluster_id"].agg(lambda c: c.value_counts().index[0])
+    summary = summary.fillna({"leaking_members": 0, "max_jaccard": 0.0, "train_clusters": 0})
+    summary["leaking_members"] = summary["leaking_members"].astype(int)
+    summary["train_clusters"] = summary["train_clusters"].astype(int)
+    summary["leaking_fraction"] = summary["leaking_members"] / summary["members"]
+    summary = summary.sort_values(["leaking_fraction", "max_jaccard"], ascending=False).reset_index()
+    return pair_table, summary
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="MinHash/LSH audit of near-duplicate sequences across splits.")
+    parser.add_argument("--fasta", default="output_sequences.fasta", help="FASTA written by 2. make_fasta.py.")
+    parser.add_argument("--cluster-mapping", default=f"{data_path}/data/clusterRes_cluster.tsv")
+    parser.add_argument("--split-dir", default=".", help="Directory with the *_clusters.txt files.")
+    parser.add_argument("--signatures", default="minhash",
+                        help="Prefix of the signature files; reused if they exist with the same --k, --num-perm and --seed.")
+    parser.add_argument("--k", type=int, default=5, help="k-mer length.")
+    parser.add_argument("--num-perm", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=42, help="Seed of the MinHash permutations.")
+    parser.add_argument("--bands", type=int, default=16)
+    parser.add_argument("--threshold", type=float, default=0.5, help="Minimum estimated Jaccard to report.")
+    parser.add_argument("--max-bucket", type=int, default=1000)
+    parser.add_argument("--processes", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--out-dir", default=".")
+    args = parser.parse_args()
+
+    cached = load_signatures(args.signatures, args.k, args.num_perm, args.seed)
+    if cached is not None:
+        ids, signatures = cached
+        print(f"Loaded {len(ids):,} signatures from {args.signatures}.sig.npy")
+    else:
+        ids, signatures = build_signatures(args.fasta, args.signatures, args.k, args.num_perm, args.seed,
+                                           processes=args.processes)
+        print(f"Saved {len(ids):,} signatures to {args.signatures}.sig.npy")
+
+    clusters, splits = protein_splits(ids, args.cluster_mapping, args.split_dir)
+    pairs, summary = find_leakage(ids, np.asarray(signatures), clusters, splits, args.bands, args.threshold,
+                                  args.max_bucket)
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    pairs.to_csv(os.path.join(args.out_dir, "leakage_pairs.tsv"), sep="\t", index=False)
+    summary.to_csv(os.path.join(args.out_dir, "leakage_clusters.tsv"), sep="\t", index=False)
+    for split in ("val", "test"):
+        part = summary[summary["split"] == split]
+        print(f"{split}: {part['leaking_members'].sum():,} of {part['members'].sum():,} proteins in "
+              f"{(part['leaking_members'] > 0).sum():,} of {len(part):,} clusters have a train neighbour")
@@ -0,0 +1,422 @@
+import json
+import os
+import socket
+import socketserver
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional
+from urllib.parse import parse_qs, unquote, urlparse
+
+import ijson
+import numpy as np
+
+from cluster_stats import load_cluster_index, lookup_sorted
+from compressed_io import open_file, open_seekable
+
+data_path = "/mnt/gemini/data/ramith/CMU-project/data/raw"
+
+# Small frames keep a single lookup to one short decompression.
+_FRAME_SIZE = 256 * 1024
+
+SPLITS = ("train", "val", "test")
+
+
+def strip_sdf(ligand_id: str) -> str:
+    return ligand_id[:-4] if ligand_id.endswith('.sdf') else ligand_id
+
+
+class _ValueStoreWriter:
+    """Appends JSON values to `<name>.values.zst` and records their offsets in `<name>.index.npz`."""
+
+    def __init__(self, index_dir: str, name: str, frame_size: int = _FRAME_SIZE):
+        self.index_dir = index_dir
+        self.name = name
+        self._fh = open_file(os.path.join(index_dir, f"{name}.values.zst"), 'wb', frame_size=frame_size)
+        self._keys = []
+        self._offsets = []
+        self._lengths = []
+        self._offset = 0
+
+    def add(self, key: str, value):
+        data = json.dumps(value).encode('utf-8') + b"\n"
+        self._fh.write(data)
+        self._keys.append(key)
+        self._offsets.append(self._offset)
+        self._lengths.append(len(data))
+        self._offset += len(data)
+
+    def close(self) -> int:
+        self._fh.close()
+        keys = np.asarray(self._keys, dtype='S')
+        order = np.argsort(keys, kind='stable')
+        np.savez(os.path.join(self.index_dir, f"{self.name}.index.npz"), keys=keys[order],
+                 offsets=np.asarray(self._offsets, dtype=np.int64)[order],
+                 lengths=np.asarray(self._lengths, dtype=np.int32)[order])
+        return len(keys)
+
+
+class ValueStore:
+    """Random access to a store written by _ValueStoreWriter; safe to share between threads."""
+
+    def __init__(self, index_dir: str, name: str):
+        try:
+            with np.load(os.path.join(index_dir, f"{name}.index.npz")) as index:
+                self.keys, self.offsets, self.lengths = index["keys"], index["offsets"], index["lengths"]
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Index not found: {index_dir}/{name}.index.npz (run `lookup_service.py build`)")
+        self._fh = open_seekable(os.path.join(index_dir, f"{name}.values.zst"), 'rb')
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: List[str]) -> List[Optional[any]]:
+        if not keys:
+            return []
+        pos = lookup_sorted(self.keys, np.asarray(keys, dtype='S'))
+        values = [None] * len(keys)
+        # read in file order so neighbouring keys share decompressed frames
+        found = np.flatnonzero(pos >= 0)
+        found = found[np.argsort(self.offsets[pos[found]])]
+        with self._lock:
+            for i in found.tolist():
+                self._fh.seek(int(self.offsets[pos[i]]))
+                values[i] = json.loads(self._fh.read(int(self.lengths[pos[i]])))
+        return values
+
+    def close(self):
+        self._fh.close()
+
+
+class LRUCache:
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        if self.capacity <= 0:
+            return
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.capacity:
+                self._items.popitem(last=False)
+
+
+def build_index(index_dir: str, raw_dir: str, cluster_mapping_file: str, split_dir: str,
+                ids_file: Optional[str] = None, frame_size: int = _FRAME_SIZE):
+    """
+    Builds the persistent lookup indexes in one pass over each raw file.
+
+    Proteins are limited to those in protein2ligand_id.json (or to `ids_file`).
+    Sequences missing from uniprot2seq.json are taken from uniref50.jsonl,
+    like 2. make_fasta.py does.
+    """
+    os.makedirs(index_dir, exist_ok=True)
+
+    with open_file(f"{raw_dir}/protein2ligand_id.json", 'r') as f:
+        protein2ligand = json.load(f)
+    wanted = set(protein2ligand)
+    if ids_file:
+        with open(ids_file, 'r') as f:
+            wanted &= {line.strip() for line in f if line.strip()}
+
+    store = _ValueStoreWriter(index_dir, "ligands", frame_size)
+    ligand2proteins = {}
+    for uniprot_id, ligand_list in protein2ligand.items():
+        if uniprot_id not in wanted:
+            continue
+        ligands = list(dict.fromkeys(strip_sdf(lig) for lig in ligand_list))
+        store.add(uniprot_id, ligands)
+        for ligand in ligands:
+            ligand2proteins.setdefault(ligand, []).append(uniprot_id)
+    print(f"ligands: {store.close():,} proteins")
+    del protein2ligand
+
+    store = _ValueStoreWriter(index_dir, "ligand_proteins", frame_size)
+    for ligand, proteins in ligand2proteins.items():
+        store.add(ligand, proteins)
+    print(f"ligand_proteins: {store.close():,} ligands")
+
+    with open_file(f"{raw_dir}/ligand2smiles.json", 'r') as f:
+        ligand2smiles = json.load(f)
+    store = _ValueStoreWriter(index_dir, "smiles", frame_size)
+    for ligand, smiles in ligand2smiles.items():
+        store.add(ligand, smiles)
+    print(f"smiles: {store.close():,} ligands")
+    del ligand2smiles, ligand2proteins
+
+    store = _ValueStoreWriter(index_dir, "text", frame_size)
+    with open_file(f"{raw_dir}/uniprot2text.json", 'rb') as f:
+        for uniprot_id, text in ijson.kvitems(f, ''):
+            if uniprot_id in wanted:
+                store.add(uniprot_id, text)
+    print(f"text: {store.close():,} proteins")
+
+    store = _ValueStoreWriter(index_dir, "sequence", frame_size)
+    missing = set(wanted)
+    with open_file(f"{raw_dir}/uniprot2seq.json", 'rb') as f:
+        for uniprot_id, sequence in ijson.kvitems(f, ''):
+            if uniprot_id in missing:
+                store.add(uniprot_id, sequence)
+                missing.remove(uniprot_id)
+    with open_file(f"{raw_dir}/uniref50.jsonl", 'r') as f:
+        for line in f:
+            if not missing:
+                break
+            uniprot_id, sequence = next(iter(json.loads(line).items()))
+            if uniprot_id in missing:
+                store.add(uniprot_id, sequence)
+                missing.remove(uniprot_id)
+    print(f"sequence: {store.close():,} proteins ({len(missing):,} without a sequence)")
+
+    cluster_names, protein_ids, protein_cluster = load_cluster_index(cluster_mapping_file)
+    cluster_split = np.full(len(cluster_names), "", dtype=object)
+    cluster_index = {name: i for i, name in enumerate(cluster_names)}
+    for split in SPLITS:
+        path = os.path.join(split_dir, f"{split}_clusters.txt")
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r') as f:
+            for line in f:
+                i = cluster_index.get(line.strip())
+                if i is not None:
+                    cluster_split[i] = split
+    np.savez(os.path.join(index_dir, "clusters.npz"), cluster_names=cluster_names.astype(str),
+             cluster_split=cluster_split.astype(str), protein_ids=protein_ids, protein_cluster=protein_cluster)
+    print(f"clusters: {len(cluster_names):,} clusters, {len(protein_ids):,} proteins")
+
+
+class LookupIndex:
+    """
+    Millisecond lookups over the indexes written by build_index:
+
+        index.proteins(["P12345"])  -> {"P12345": {"seq", "text", "ligands", "cluster", "split"}}
+        index.ligands(["CHEBI_17568"]) -> {"CHEBI_17568": {"smiles", "proteins"}}
+
+    Unknown IDs map to None. Assembled records are kept in an LRU cache.
+    """
+
+    def __init__(self, index_dir: str, cache_size: int = 100000):
+        self.stores = {name: ValueStore(index_dir, name)
+                       for name in ("sequence", "text", "ligands", "smiles", "ligand_proteins")}
+        with np.load(os.path.join(index_dir, "clusters.npz")) as clusters:
+            self.cluster_names = clusters["cluster_names"]
+            self.cluster_split = clusters["cluster_split"]
+            self.protein_ids = clusters["protein_ids"]
+            self.protein_cluster = clusters["protein_cluster"]
+        self._proteins = LRUCache(cache_size)
+        self._ligands = LRUCache(cache_size)
+
+    def proteins(self, uniprot_ids: Iterable[str]) -> Dict[str, Optional[dict]]:
+        uniprot_ids = list(dict.fromkeys(uniprot_ids))
+        result = {uid: self._proteins.get(uid) for uid in uniprot_ids}
+        todo = [uid for uid, record in result.items() if record is None]
+        if not todo:
+            return result
+
+        values = {name: self.stores[name].get_many(todo) for name in ("sequence", "text", "ligands")}
+        pos = lookup_sorted(self.protein_ids, np.asarray(todo, dtype='S'))
+        for i, uid in enumerate(todo):
+            cluster = self.protein_cluster[pos[i]] if pos[i] >= 0 else -1
+            record = {
+                "seq": values["sequence"][i],
+                "text": values["text"][i],
+                "ligands": values["ligands"][i],
+                "cluster": str(self.cluster_names[cluster]) if cluster >= 0 else None,
+                "split": (str(self.cluster_split[cluster]) or None) if cluster >= 0 else None,
+            }
+            if all(value is None for value in record.values()):
+                record = None
+            else:
+                self._proteins.put(uid, record)
+            result[uid] = record
+        return result
+
+    def ligands(self, ligand_ids: Iterable[str]) -> Dict[str, Optional[dict]]:
+        ligand_ids = list(dict.fromkeys(ligand_ids))
+        result = {lid: self._ligands.get(strip_sdf(lid)) for lid in ligand_ids}
+        todo = [lid for lid, record in result.items() if record is None]
+        if not todo:
+            return result
+
+        keys = [strip_sdf(lid) for lid in todo]
+        smiles = self.stores["smiles"].get_many(keys)
+        proteins = self.stores["ligand_proteins"].get_many(keys)
+        for lid, key, s, p in zip(todo, keys, smiles, proteins):
+            record = None
+            if s is not None or p is not None:
+                record = {"smiles": s, "proteins": p or []}
+                self._ligands.put(key, record)
+            result[lid] = record
+        return result
+
+    def lookup(self, request: dict) -> dict:
+        """
+        Batched lookup: {"proteins": [...], "ligands": [...]} -> {"proteins": {...}, "ligands": {...}}
+
+        Raises:
+            ValueError if the request is not an object of lists of ID strings.
+        """
+        if not isinstance(request, dict):
+            raise ValueError("request must be a JSON object")
+        for key in ("proteins", "ligands"):
+            ids = request.get(key, [])
+            if not isinstance(ids, list) or not all(isinstance(i, str) for i in ids):
+                raise ValueError(f"'{key}' must be a list of strings")
+        return {
+            "proteins": self.proteins(request.get("proteins", [])),
+            "ligands": self.ligands(request.get("ligands", [])),
+        }
+
+    def close(self):
+        for store in self.stores.values():
+            store.close()
+
+
+def make_http_handler(index: LookupIndex):
+    """
+    GET  /protein/<uniprot_id>, /ligand/<ligand_id>
+    GET  /lookup?proteins=A,B&ligands=C
+    POST /lookup  {"proteins": [...], "ligands": [...]}
+    """
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, status: int, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            url = urlparse(self.path)
+            parts = [unquote(p) for p in url.path.strip('/').split('/')]
+            if len(parts) == 2 and parts[0] == "protein":
+                record = index.proteins([parts[1]])[parts[1]]
+                self._reply(200 if record else 404, record)
+            elif len(parts) == 2 and parts[0] == "ligand":
+                record = index.ligands([parts[1]])[parts[1]]
+                self._reply(200 if record else 404, record)
+            elif parts == ["lookup"]:
+                query = parse_qs(url.query)
+                self._reply(200, index.lookup({key: [i for value in query.get(key, []) for i in value.split(",") if i]
+                                               for key in ("proteins", "ligands")}))
+            else:
+                self._reply(404, {"error": f"unknown path {url.path}"})
+
+        def do_POST(self):
+            if urlparse(self.path).path.strip('/') != "lookup":
+                self._reply(404, {"error": f"unknown path {self.path}"})
+                return
+            try:
+                # a JSONDecodeError or an invalid request (both ValueError) is the client's fault
+                response = index.lookup(json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0)))))
+            except ValueError as e:
+                self._reply(400, {"error": str(e)})
+                return
+            self._reply(200, response)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def make_socket_handler(index: LookupIndex):
+    """One JSON request per line in, one JSON response per line out."""
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            for line in self.rfile:
+                try:
+                    response = index.lookup(json.loads(line))
+                except ValueError as e:
+                    response = {"error": str(e)}
+                self.wfile.write(json.dumps(response).encode('utf-8') + b"\n")
+
+    return Handler
+
+
+def serve(index: LookupIndex, host: str = "127.0.0.1", port: int = 8765, socket_path: Optional[str] = None):
+    if socket_path:
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        server = socketserver.ThreadingUnixStreamServer(socket_path, make_socket_handler(index))
+        print(f"Serving lookups on unix socket {socket_path}")
+    else:
+        server = ThreadingHTTPServer((host, port), make_http_handler(index))
+        print(f"Serving lookups on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if socket_path and os.path.exists(socket_path):
+            os.remove(socket_path)
+
+
+def query_server(request: dict, url: Optional[str] = None, socket_path: Optional[str] = None) -> dict:
+    """Sends one batched request to a running service."""
+    if socket_path:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as s:
+            s.connect(socket_path)
+            with s.makefile('rwb') as f:
+                f.write(json.dumps(request).encode('utf-8') + b"\n")
+                f.flush()
+                return json.loads(f.readline())
+
+    from urllib.request import Request, urlopen
+    data = json.dumps(request).encode('utf-8')
+    with urlopen(Request(url.rstrip('/') + "/lookup", data=data, headers={"Content-Type": "application/json"})) as r:
+        return json.loads(r.read())
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Indexed protein/ligand lookups without rescanning the raw files.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    build_parser = subparsers.add_parser("build", help="Build the persistent indexes.")
+    build_parser.add_argument("index_dir")
+    build_parser.add_argument("--raw-dir", default=f"{data_path}/data")
+    build_parser.add_argument("--cluster-mapping", default=f"{data_path}/data/clusterRes_cluster.tsv")
+    build_parser.add_argument("--split-dir", default=".", help="Directory with the *_clusters.txt files.")
+    build_parser.add_argument("--ids", default=None, help="Only index these proteins (e.g. selected_uniprot_ids.txt).")
+
+    serve_parser = subparsers.add_parser("serve", help="Serve lookups over HTTP or a unix socket.")
+    serve_parser.add_argument("index_dir")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--socket", default=None, help="Serve on this unix socket instead of HTTP.")
+    serve_parser.add_argument("--cache-size", type=int, default=100000)
+
+    get_parser = subparsers.add_parser("get", help="Look up proteins (or ligands with --ligand).")
+    get_parser.add_argument("ids", nargs="+")
+    get_parser.add_argument("--ligand", action="store_true")
+    source = get_parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--index-dir", help="Read the indexes directly.")
+    source.add_argument("--url", help="Query a running HTTP service, e.g. http://127.0.0.1:8765.")
+    source.add_argument("--socket", help="Query a running unix socket service.")
+
+    args = parser.parse_args()
+    if args.command == "build":
+        build_index(args.index_dir, args.raw_dir, args.cluster_mapping, args.split_dir, args.ids)
+    elif args.command == "serve":
+        serve(LookupIndex(args.index_dir, args.cache_size), args.host, args.port, args.socket)
+    else:
+        request = {"ligands" if args.ligand else "proteins": args.ids}
+        if args.index_dir:
+            index = LookupIndex(args.index_dir, cache_size=0)
+            response = index.lookup(request)
+            index.close()
+        else:
+            response = query_server(request, args.url, args.socket)
+        print(json.dumps(response, indent=2))
@@ -0,0 +1,115 @@
+import filecmp
+import os
+import struct
+import subprocess
+import tempfile
+
+# MMseqs2 database types (Parameters::DBTYPE_*), stored as a little-endian int in <db>.dbtype
+DBTYPE_AMINO_ACIDS = 0
+DBTYPE_GENERIC_DB = 12
+
+_BUFFER_SIZE = 16 * 1024 * 1024
+
+
+class MMseqsDBWriter:
+    """
+    Writes an MMseqs2 sequence database directly, in the layout
+    `mmseqs createdb <fasta> <prefix> --shuffle 0` produces:
+
+        <prefix>            sequences, each followed by "\\n\\0"
+        <prefix>.index      key \\t offset \\t length (length includes "\\n\\0")
+        <prefix>.dbtype     amino acid database type
+        <prefix>_h          headers, each followed by "\\n\\0"
+        <prefix>_h.index
+        <prefix>_h.dbtype
+        <prefix>.lookup     key \\t accession \\t file number
+        <prefix>.source     file number \\t source name
+
+    so clustering can start with `mmseqs cluster <prefix> ...` without createdb.
+    Entries get consecutive keys in the order they are added.
+    """
+
+    def __init__(self, prefix: str, source_name: str = "output_sequences.fasta"):
+        self.prefix = prefix
+        self.source_name = source_name
+        self._data = open(prefix, 'wb', buffering=_BUFFER_SIZE)
+        self._index = open(f"{prefix}.index", 'w', buffering=_BUFFER_SIZE)
+        self._headers = open(f"{prefix}_h", 'wb', buffering=_BUFFER_SIZE)
+        self._header_index = open(f"{prefix}_h.index", 'w', buffering=_BUFFER_SIZE)
+        self._lookup = open(f"{prefix}.lookup", 'w', buffering=_BUFFER_SIZE)
+        self._data_offset = 0
+        self._header_offset = 0
+        self.count = 0
+
+    def add(self, uniprot_id: str, sequence: str):
+        key = self.count
+        entry = sequence.encode('ascii') + b"\n\0"
+        self._data.write(entry)
+        self._index.write(f"{key}\t{self._data_offset}\t{len(entry)}\n")
+        self._data_offset += len(entry)
+
+        header = uniprot_id.encode('utf-8') + b"\n\0"
+        self._headers.write(header)
+        self._header_index.write(f"{key}\t{self._header_offset}\t{len(header)}\n")
+        self._header_offset += len(header)
+
+        self._lookup.write(f"{key}\t{uniprot_id}\t0\n")
+        self.count += 1
+
+    def close(self):
+        for f in (self._data, self._index, self._headers, self._header_index, self._lookup):
+            f.close()
+        _write_dbtype(f"{self.prefix}.dbtype", DBTYPE_AMINO_ACIDS)
+        _write_dbtype(f"{self.prefix}_h.dbtype", DBTYPE_GENERIC_DB)
+        with open(f"{self.prefix}.source", 'w') as f:
+            f.write(f"0\t{self.source_name}\n")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _write_dbtype(path: str, dbtype: int):
+    with open(path, 'wb') as f:
+        f.write(struct.pack("<i", dbtype))
+
+
+def verify_against_createdb(prefix: str, fasta_path: str, mmseqs: str = "mmseqs") -> bool:
+    """
+    Round-trip check with a local mmseqs build: the FASTA is converted with
+    `mmseqs createdb --shuffle 0`, both databases are exported again with
+    `mmseqs convert2fasta`, and the exports must be identical. Byte-level
+    differences of the individual database files are reported as well.
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        ref = os.path.join(tmp, "ref")
+        subprocess.run([mmseqs, "createdb", fasta_path, ref, "--shuffle", "0", "-v", "1"], check=True)
+
+        for suffix in ("", ".index", ".dbtype", "_h", "_h.index", "_h.dbtype", ".lookup"):
+            same = filecmp.cmp(f"{prefix}{suffix}", f"{ref}{suffix}", shallow=False)
+            print(f"{os.path.basename(prefix)}{suffix}: {'identical' if same else 'differs'} to createdb")
+
+        ours_fasta = os.path.join(tmp, "ours.fasta")
+        ref_fasta = os.path.join(tmp, "ref.fasta")
+        subprocess.run([mmseqs, "convert2fasta", prefix, ours_fasta, "-v", "1"], check=True)
+        subprocess.run([mmseqs, "convert2fasta", ref, ref_fasta, "-v", "1"], check=True)
+        ok = filecmp.cmp(ours_fasta, ref_fasta, shallow=False)
+
+    print("mmseqs reads the database identically to the FASTA path" if ok
+          else "mmseqs reads the database DIFFERENTLY from the FASTA path")
+    return ok
+
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Check a database written by MMseqsDBWriter against mmseqs createdb.")
+    parser.add_argument("db_prefix")
+    parser.add_argument("fasta")
+    parser.add_argument("--mmseqs", default="mmseqs", help="Path to the mmseqs binary.")
+    args = parser.parse_args()
+
+    sys.exit(0 if verify_against_createdb(args.db_prefix, args.fasta, args.mmseqs) else 1)
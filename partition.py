@@ -0,0 +1,211 @@
+import hashlib
+import json
+import os
+import zlib
+from typing import Dict, List, Optional
+
+import ijson
+
+from compressed_io import open_file, resolve_path
+from dedup import collapse_duplicates
+
+data_path = "/mnt/gemini/data/ramith/CMU-project/data/raw"
+
+# Raw files stage 5 streams per protein; these are the ones worth pre-partitioning.
+PARTITIONED_SOURCES = ("uniprot2seq.json", "uniprot2text.json")
+
+# Written by stage 5 --collapse-duplicates; collapsed again across partitions by merge_partitions.
+DEDUP_FILE_NAME = "train_dataset_dedup_tokenized.jsonl"
+
+
+def partition_of(uniprot_id: str, num_partitions: int) -> int:
+    """Stable partition of an accession (crc32, identical on every node and Python version)."""
+    return zlib.crc32(uniprot_id.encode('utf-8')) % num_partitions
+
+
+def partition_tag(partition_id: int, num_partitions: int) -> str:
+    return f"part-{partition_id:05d}-of-{num_partitions:05d}"
+
+
+def partition_file_name(file_name: str, partition_id: int, num_partitions: int) -> str:
+    """train_dataset_tokenized.jsonl -> train_dataset_tokenized.part-00003-of-00008.jsonl"""
+    stem, ext = os.path.splitext(file_name)
+    return f"{stem}.{partition_tag(partition_id, num_partitions)}{ext}"
+
+
+def split_inputs(raw_dir: str, out_dir: str, num_partitions: int, suffix: str = ".zst"):
+    """
+    Splits the large {uniprot_id: value} inputs into `num_partitions` JSON
+    objects by accession hash, in one pass per file, so that each node of a
+    partitioned stage 5 run only reads its own slice.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    for source in PARTITIONED_SOURCES:
+        outs = [open_file(os.path.join(out_dir, partition_file_name(source, k, num_partitions) + suffix), 'w')
+                for k in range(num_partitions)]
+        counts = [0] * num_partitions
+        try:
+            for f in outs:
+                f.write("{")
+            with open_file(os.path.join(raw_dir, source), 'rb') as f_in:
+                for key, value in ijson.kvitems(f_in, ''):
+                    k = partition_of(key, num_partitions)
+                    outs[k].write(("," if counts[k] else "") + json.dumps(key) + ": " + json.dumps(value))
+                    counts[k] += 1
+            for f in outs:
+                f.write("}")
+        finally:
+            for f in outs:
+                f.close()
+        print(f"{source}: {sum(counts):,} keys split into {num_partitions} partitions")
+
+
+def partition_input_path(partitioned_dir: str, source: str, partition_id: int, num_partitions: int) -> str:
+    return resolve_path(os.path.join(partitioned_dir, partition_file_name(source, partition_id, num_partitions)))
+
+
+def file_checksum(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def count_records(path: str) -> int:
+    with open_file(path, 'r') as f:
+        return sum(1 for line in f if line.strip())
+
+
+def write_partition_manifest(output_dir: str, file_names: List[str], partition_id: int, num_partitions: int,
+                             suffix: str = "", shard_dirs: Optional[Dict[str, str]] = None) -> Dict[str, any]:
+    """
+    Records the record count and sha256 of every shard this partition wrote,
+    as `_partition-<tag>.json` next to the shards.
+
+    `shard_dirs` maps a name (e.g. "bucketed_shards") to a directory of
+    shards built from this partition's training split; its manifest.json
+    gives the record count and is checksummed in place of the shards.
+    """
+    shards = {}
+    for file_name in file_names:
+        shard = partition_file_name(file_name, partition_id, num_partitions) + suffix
+        path = os.path.join(output_dir, shard)
+        shards[file_name] = {"path": shard, "records": count_records(path), "sha256": file_checksum(path)}
+
+    dirs = {}
+    for name, shard_dir in (shard_dirs or {}).items():
+        manifest_path = os.path.join(shard_dir, "manifest.json")
+        with open(manifest_path, 'r') as f:
+            records = json.load(f)["records"]
+        dirs[name] = {"path": os.path.relpath(shard_dir, output_dir), "records": records,
+                      "sha256": file_checksum(manifest_path)}
+
+    manifest = {"partition_id": partition_id, "num_partitions": num_partitions, "shards": shards, "shard_dirs": dirs}
+    tmp_path = os.path.join(output_dir, f"._partition-{partition_tag(partition_id, num_partitions)}.json")
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2)
+    # the manifest only appears once the partition is complete
+    os.replace(tmp_path, os.path.join(output_dir, f"_partition-{partition_tag(partition_id, num_partitions)}.json"))
+    return manifest
+
+
+def merge_partitions(output_dir: str, num_partitions: int, verify: bool = True,
+                     dedup_memory_budget: int = 8 * 1024 ** 3) -> Dict[str, any]:
+    """
+    Checks that every partition finished and writes the global manifest.json
+    with per-dataset record totals and the list of shards, and the same for
+    the shard directories (bucketed / shuffled shards) of every partition.
+
+    Partitions are cut by accession, so most duplicate records sit in
+    different partitions. If the partitions wrote collapsed training shards,
+    these are collapsed once more into one `train_dataset_dedup_tokenized.jsonl`
+    in `output_dir`, which replaces the per-partition shards in the manifest.
+
+    Raises:
+        RuntimeError if partitions are missing, a shard does not match its
+        checksum or only some partitions wrote a shard directory.
+    """
+    missing = []
+    partitions = []
+    for k in range(num_partitions):
+        path = os.path.join(output_dir, f"_partition-{partition_tag(k, num_partitions)}.json")
+        if not os.path.exists(path):
+            missing.append(k)
+            continue
+        with open(path, 'r') as f:
+            partitions.append(json.load(f))
+    if missing:
+        raise RuntimeError(f"{len(missing)} of {num_partitions} partitions have not finished: {missing}")
+
+    datasets = {}
+    bad = []
+    for manifest in partitions:
+        for file_name, shard in manifest["shards"].items():
+            if verify and file_checksum(os.path.join(output_dir, shard["path"])) != shard["sha256"]:
+                bad.append(shard["path"])
+            entry = datasets.setdefault(file_name, {"records": 0, "shards": []})
+            entry["records"] += shard["records"]
+            entry["shards"].append(shard)
+
+    shard_dirs = {}
+    for manifest in partitions:
+        for name, shard_dir in manifest.get("shard_dirs", {}).items():
+            if verify and file_checksum(os.path.join(output_dir, shard_dir["path"], "manifest.json")) != shard_dir["sha256"]:
+                bad.append(shard_dir["path"])
+            entry = shard_dirs.setdefault(name, {"records": 0, "partitions": []})
+            entry["records"] += shard_dir["records"]
+            entry["partitions"].append(shard_dir)
+    if bad:
+        raise RuntimeError(f"Checksum mismatch for {len(bad)} shards: {bad}")
+    incomplete = [name for name, entry in shard_dirs.items() if len(entry["partitions"]) != num_partitions]
+    if incomplete:
+        raise RuntimeError(f"Shard directories written by only some partitions: {incomplete}")
+
+    if DEDUP_FILE_NAME in datasets:
+        shard_paths = [os.path.join(output_dir, shard["path"]) for shard in datasets[DEDUP_FILE_NAME]["shards"]]
+        merged = DEDUP_FILE_NAME + shard_paths[0][shard_paths[0].rindex(".jsonl") + len(".jsonl"):]
+        merged_path = os.path.join(output_dir, merged)
+        stats = collapse_duplicates(shard_paths, merged_path, dedup_memory_budget)
+        print(f"{DEDUP_FILE_NAME}: {stats['records']:,} records of {num_partitions} partitions collapsed "
+              f"to {stats['unique']:,} in {merged}")
+        datasets[DEDUP_FILE_NAME] = {
+            "records": stats["unique"],
+            "shards": [{"path": merged, "records": stats["unique"], "sha256": file_checksum(merged_path)}],
+            "collapsed_across_partitions": True,
+        }
+
+    manifest = {"num_partitions": num_partitions, "datasets": datasets, "shard_dirs": shard_dirs}
+    with open(os.path.join(output_dir, "manifest.json"), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Partitioned stage 5 helpers.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    split_parser = subparsers.add_parser("split-inputs", help="Split the sequence/text inputs by accession hash.")
+    split_parser.add_argument("out_dir")
+    split_parser.add_argument("--num-partitions", type=int, required=True)
+    split_parser.add_argument("--raw-dir", default=f"{data_path}/data")
+
+    merge_parser = subparsers.add_parser("merge", help="Check all partitions and write the global manifest.")
+    merge_parser.add_argument("output_dir")
+    merge_parser.add_argument("--num-partitions", type=int, required=True)
+    merge_parser.add_argument("--no-verify", action="store_true", help="Skip re-checking shard checksums.")
+    merge_parser.add_argument("--dedup-memory-gb", type=float, default=8.0,
+                              help="Approximate memory budget for collapsing duplicates across partitions.")
+
+    args = parser.parse_args()
+    if args.command == "split-inputs":
+        split_inputs(args.raw_dir, args.out_dir, args.num_partitions)
+    else:
+        manifest = merge_partitions(args.output_dir, args.num_partitions, verify=not args.no_verify,
+                                    dedup_memory_budget=int(args.dedup_memory_gb * 1024 ** 3))
+        for file_name, entry in manifest["datasets"].items():
+            print(f"{file_name}: {entry['records']:,} records in {len(entry['shards'])} shards")
+        for name, entry in manifest["shard_dirs"].items():
+            print(f"{name}: {entry['records']:,} records in {len(entry['partitions'])} partition directories")
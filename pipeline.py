@@ -0,0 +1,107 @@
+import queue
+import threading
+from typing import Any, Callable, Iterable
+
+_DONE = object()
+
+
+def run_pipeline(source: Iterable[Any], work_fn: Callable[[Any], Any], sink_fn: Callable[[Any], None],
+                 num_workers: int = 4, max_in_flight: int = 1024):
+    """
+    Runs a reader -> workers -> ordered writer pipeline over `source`.
+
+    A reader thread pulls items from `source`, `num_workers` threads apply
+    `work_fn` to them and a writer thread hands the results to `sink_fn` in
+    the same order the items were read, so the output is deterministic
+    regardless of the number of workers.
+
+    At most `max_in_flight` items are between the reader and the writer at
+    any time: the reader blocks once that many are queued or waiting to be
+    written, which keeps memory bounded when the writer or the workers are
+    the bottleneck.
+
+    Args:
+        source: Iterable of work items (read on the reader thread).
+        work_fn: Function applied to each item on a worker thread.
+        sink_fn: Function called with each result, in source order, on the writer thread.
+        num_workers: Number of worker threads.
+        max_in_flight: Bound on items read but not yet written.
+
+    Raises:
+        The first exception raised by the source, a worker or the sink.
+    """
+    if num_workers < 1:
+        raise ValueError(f"num_workers must be at least 1, got {num_workers}")
+    if max_in_flight < 1:
+        raise ValueError(f"max_in_flight must be at least 1, got {max_in_flight}")
+
+    slots = threading.Semaphore(max_in_flight)
+    in_queue = queue.Queue()
+    out_queue = queue.Queue()
+    stop = threading.Event()
+    errors = []
+
+    def fail(e):
+        errors.append(e)
+        stop.set()
+
+    def reader():
+        try:
+            for i, item in enumerate(source):
+                slots.acquire()
+                if stop.is_set():
+                    break
+                in_queue.put((i, item))
+        except BaseException as e:
+            fail(e)
+        finally:
+            for _ in range(num_workers):
+                in_queue.put(_DONE)
+
+    def worker():
+        while True:
+            task = in_queue.get()
+            if task is _DONE:
+                out_queue.put(_DONE)
+                return
+            i, item = task
+            result = None
+            if not stop.is_set():
+                try:
+                    result = work_fn(item)
+                except BaseException as e:
+                    fail(e)
+            out_queue.put((i, result))
+
+    def writer():
+        pending = {}
+        next_index = 0
+        finished_workers = 0
+        while finished_workers < num_workers:
+            message = out_queue.get()
+            if message is _DONE:
+                finished_workers += 1
+                continue
+            i, result = message
+            pending[i] = result
+            while next_index in pending:
+                result = pending.pop(next_index)
+                next_index += 1
+                if not stop.is_set():
+                    try:
+                        sink_fn(result)
+                    except BaseException as e:
+                        fail(e)
+                slots.release()
+
+    threads = [threading.Thread(target=reader, name="pipeline-reader")]
+    threads += [threading.Thread(target=worker, name=f"pipeline-worker-{n}") for n in range(num_workers)]
+    threads.append(threading.Thread(target=writer, name="pipeline-writer"))
+
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    if errors:
+        raise errors[0]
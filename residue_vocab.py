@@ -0,0 +1,161 @@
+import json
+import os
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from compressed_io import open_file
+
+STANDARD_RESIDUES = "ACDEFGHIKLMNPQRSTVWY"
+# X: unknown, B: D/N, Z: E/Q, J: I/L, U: selenocysteine, O: pyrrolysine
+NONSTANDARD_RESIDUES = "XBZJUO"
+SPECIAL_TOKENS = ("<pad>", "<unk>")
+
+_FLUSH_RESIDUES = 1 << 22
+
+
+class ResidueVocab:
+    """
+    Maps amino-acid letters to uint8 IDs through a 256-entry lookup table.
+
+    IDs are assigned in order: special tokens, standard residues, then one
+    token per non-standard letter ("<X>", "<B>", ...). Lower case letters map
+    like upper case ones; any other byte maps to "<unk>".
+    """
+
+    def __init__(self, residues: str = STANDARD_RESIDUES, nonstandard: str = NONSTANDARD_RESIDUES,
+                 specials: Sequence[str] = SPECIAL_TOKENS):
+        if "<unk>" not in specials:
+            raise ValueError("specials must contain '<unk>'")
+        self.residues = residues
+        self.nonstandard = nonstandard
+        self.specials = tuple(specials)
+        self.tokens = list(self.specials) + list(residues) + [f"<{c}>" for c in nonstandard]
+        if len(self.tokens) > 256:
+            raise ValueError(f"{len(self.tokens)} tokens do not fit in uint8")
+        if len(set(residues + nonstandard)) != len(residues) + len(nonstandard):
+            raise ValueError("residue letters must be unique")
+
+        self.lut = np.full(256, self.token_id("<unk>"), dtype=np.uint8)
+        letters = [(c, c) for c in residues] + [(c, f"<{c}>") for c in nonstandard]
+        for letter, token in letters:
+            self.lut[ord(letter.upper())] = self.lut[ord(letter.lower())] = self.token_id(token)
+
+    def token_id(self, token: str) -> int:
+        return self.tokens.index(token)
+
+    def encode(self, sequence: str) -> np.ndarray:
+        return self.lut[np.frombuffer(sequence.encode('ascii', errors='replace'), dtype=np.uint8)]
+
+    def encode_batch(self, sequences: List[str]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Encodes many sequences with one table lookup.
+
+        Returns:
+            (ids, lengths): the concatenated uint8 IDs and the length of each sequence.
+        """
+        lengths = np.fromiter((len(s) for s in sequences), dtype=np.int64, count=len(sequences))
+        return self.encode("".join(sequences)), lengths
+
+    def decode(self, ids: np.ndarray) -> str:
+        return "".join(self.tokens[i] for i in ids.tolist())
+
+    def to_dict(self) -> Dict[str, any]:
+        return {"residues": self.residues, "nonstandard": self.nonstandard, "specials": list(self.specials),
+                "tokens": self.tokens}
+
+    def save(self, path: str):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path: str) -> "ResidueVocab":
+        try:
+            with open(path, 'r') as f:
+                config = json.load(f)
+        except FileNotFoundError:
+            raise FileNotFoundError(f"Residue vocabulary not found: {path}")
+        return cls(config.get("residues", STANDARD_RESIDUES), config.get("nonstandard", NONSTANDARD_RESIDUES),
+                   config.get("specials", SPECIAL_TOKENS))
+
+
+def sidecar_paths(jsonl_path: str) -> Tuple[str, str]:
+    """<file>.output_ids.bin (uint8 IDs of all records) and <file>.output_offsets.npy (int64, records + 1)."""
+    for suffix in (".zst", ".gz"):
+        if jsonl_path.endswith(suffix):
+            jsonl_path = jsonl_path[:-len(suffix)]
+    return f"{jsonl_path}.output_ids.bin", f"{jsonl_path}.output_offsets.npy"
+
+
+class SequenceIdWriter:
+    """
+    Writes the `output` sequence of every record of a JSONL file as uint8 IDs,
+    aligned with the record order. Sequences are buffered and encoded in
+    batches of about 4M residues.
+    """
+
+    def __init__(self, jsonl_path: str, vocab: ResidueVocab):
+        self.vocab = vocab
+        self.ids_path, self.offsets_path = sidecar_paths(jsonl_path)
+        self._fh = open(self.ids_path, 'wb')
+        self._pending = []
+        self._pending_residues = 0
+        self._lengths = []
+
+    def add(self, sequence: str, count: int = 1):
+        self._pending.extend([sequence] * count)
+        self._pending_residues += len(sequence) * count
+        if self._pending_residues >= _FLUSH_RESIDUES:
+            self.flush()
+
+    def flush(self):
+        if not self._pending:
+            return
+        ids, lengths = self.vocab.encode_batch(self._pending)
+        self._fh.write(ids.tobytes())
+        self._lengths.append(lengths)
+        self._pending = []
+        self._pending_residues = 0
+
+    def close(self):
+        self.flush()
+        self._fh.close()
+        lengths = np.concatenate(self._lengths) if self._lengths else np.zeros(0, dtype=np.int64)
+        np.save(self.offsets_path, np.concatenate([[0], np.cumsum(lengths)]).astype(np.int64))
+
+
+def load_sequence_ids(jsonl_path: str) -> Tuple[np.ndarray, np.ndarray]:
+    """Memory-maps the sidecar: ids[offsets[i]:offsets[i + 1]] are the IDs of record i."""
+    ids_path, offsets_path = sidecar_paths(jsonl_path)
+    if not os.path.exists(offsets_path):
+        raise FileNotFoundError(f"Sequence ID sidecar not found: {offsets_path}")
+    offsets = np.load(offsets_path)
+    ids = np.memmap(ids_path, dtype=np.uint8, mode='r') if offsets[-1] else np.zeros(0, dtype=np.uint8)
+    return ids, offsets
+
+
+def encode_jsonl(jsonl_path: str, vocab: ResidueVocab) -> int:
+    """Writes the sidecar for an existing JSONL file (e.g. a patched, collapsed or shuffled one)."""
+    writer = SequenceIdWriter(jsonl_path, vocab)
+    records = 0
+    with open_file(jsonl_path, 'r') as f:
+        for line in f:
+            if line.strip():
+                writer.add(json.loads(line)["output"])
+                records += 1
+    writer.close()
+    return records
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Encode the output sequences of JSONL files as uint8 residue IDs.")
+    parser.add_argument("jsonl_files", nargs="+")
+    parser.add_argument("--residue-vocab", default=None, help="JSON vocabulary (residues, nonstandard, specials).")
+    args = parser.parse_args()
+
+    vocab = ResidueVocab.load(args.residue_vocab) if args.residue_vocab else ResidueVocab()
+    for path in args.jsonl_files:
+        records = encode_jsonl(path, vocab)
+        print(f"{path}: {records:,} sequences encoded to {sidecar_paths(path)[0]}")
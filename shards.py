@@ -0,0 +1,190 @@
+import bisect
+import json
+import os
+from typing import Dict, List, Sequence, Tuple
+
+import numpy as np
+
+from compressed_io import open_file
+
+DEFAULT_FUNCTION_EDGES = (64, 128, 256)
+DEFAULT_SEQUENCE_EDGES = (128, 256, 512, 1024)
+
+
+def bucket_of(function_length: int, sequence_length: int,
+              function_edges: Sequence[int], sequence_edges: Sequence[int]) -> Tuple[int, int]:
+    """Returns the (function, sequence) bucket of a record; bucket i holds lengths in [edges[i-1], edges[i])."""
+    return bisect.bisect_right(function_edges, function_length), bisect.bisect_right(sequence_edges, sequence_length)
+
+
+def greedy_pack(lengths: np.ndarray, token_budget: int) -> List[List[int]]:
+    """
+    Best-fit-decreasing packing: records are placed, longest first, into the
+    open pack with the least remaining room that still fits them.
+    Records longer than the budget get a pack of their own.
+
+    Returns:
+        A list of packs, each a list of record indices.
+    """
+    order = np.argsort(-np.asarray(lengths), kind='stable')
+    remaining = []  # sorted (room left, pack index)
+    packs = []
+    for i in order.tolist():
+        length = int(lengths[i])
+        pos = bisect.bisect_left(remaining, (length, -1))
+        if pos < len(remaining):
+            room, pack_index = remaining.pop(pos)
+            packs[pack_index].append(i)
+            room -= length
+        else:
+            pack_index = len(packs)
+            packs.append([i])
+            room = token_budget - length
+        if room > 0:
+            bisect.insort(remaining, (room, pack_index))
+    return packs
+
+
+class _ShardWriter:
+    def __init__(self, out_dir: str, name: str, shard_size: int, token_budget: int, suffix: str):
+        self.out_dir = out_dir
+        self.name = name
+        self.shard_size = shard_size
+        self.token_budget = token_budget
+        self.suffix = suffix
+        self.shards = []
+        self._fh = None
+        self._function_lengths = []
+        self._sequence_lengths = []
+
+    def write(self, line: str, function_length: int, sequence_length: int):
+        if self._fh is None:
+            self._path = f"{self.name}_{len(self.shards):05d}.jsonl{self.suffix}"
+            self._fh = open_file(os.path.join(self.out_dir, self._path), 'w')
+        self._fh.write(line)
+        self._function_lengths.append(function_length)
+        self._sequence_lengths.append(sequence_length)
+        if len(self._function_lengths) >= self.shard_size:
+            self.close()
+
+    def close(self):
+        if self._fh is None:
+            return
+        self._fh.close()
+        self._fh = None
+
+        function_lengths = np.asarray(self._function_lengths, dtype=np.int32)
+        sequence_lengths = np.asarray(self._sequence_lengths, dtype=np.int32)
+        packs = greedy_pack(function_lengths + sequence_lengths, self.token_budget)
+        pack_offsets = np.cumsum([0] + [len(p) for p in packs], dtype=np.int64)
+        pack_indices = np.fromiter((i for p in packs for i in p), dtype=np.int64, count=int(pack_offsets[-1]))
+
+        index_path = f"{self.name}_{len(self.shards):05d}.index.npz"
+        np.savez(os.path.join(self.out_dir, index_path),
+                 function_lengths=function_lengths, sequence_lengths=sequence_lengths,
+                 pack_indices=pack_indices, pack_offsets=pack_offsets)
+
+        self.shards.append({
+            "path": self._path,
+            "index": index_path,
+            "records": len(function_lengths),
+            "packs": len(packs),
+            "tokens": int(function_lengths.sum() + sequence_lengths.sum()),
+        })
+        self._function_lengths = []
+        self._sequence_lengths = []
+
+
+def write_length_bucketed_shards(records_path: str, out_dir: str, token_budget: int,
+                                 shard_size: int = 100000,
+                                 function_edges: Sequence[int] = DEFAULT_FUNCTION_EDGES,
+                                 sequence_edges: Sequence[int] = DEFAULT_SEQUENCE_EDGES,
+                                 suffix: str = "") -> Dict[str, any]:
+    """
+    Splits a stage 5 JSONL file into shards bucketed by
+    (function token length, sequence length), in one streaming pass.
+
+    Every shard `<bucket>_<n>.jsonl` gets a companion `<bucket>_<n>.index.npz`
+    holding the per-record function_lengths and sequence_lengths and a
+    greedy packing plan for `token_budget` tokens (function + sequence) per
+    pack: pack k is pack_indices[pack_offsets[k]:pack_offsets[k + 1]],
+    as record indices into the shard. A manifest.json describes all shards.
+
+    Args:
+        records_path: Stage 5 output (e.g. train_dataset_tokenized.jsonl).
+        out_dir: Directory for the shards and the manifest.
+        token_budget: Tokens per pack.
+        shard_size: Maximum records per shard.
+        function_edges: Bucket edges for len(function_token_ids).
+        sequence_edges: Bucket edges for len(output).
+        suffix: Compression suffix for the shards ("", ".gz" or ".zst").
+
+    Returns:
+        The manifest.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    function_edges = sorted(function_edges)
+    sequence_edges = sorted(sequence_edges)
+    writers = {}
+
+    with open_file(records_path, 'r') as f:
+        for line_num, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                rec = json.loads(line)
+            except json.JSONDecodeError as e:
+                print(f"Error parsing line {line_num}: {e}")
+                continue
+            function_length = len(rec["input"]["function_token_ids"])
+            sequence_length = len(rec["output"])
+            bucket = bucket_of(function_length, sequence_length, function_edges, sequence_edges)
+            if bucket not in writers:
+                writers[bucket] = _ShardWriter(out_dir, f"bucket_f{bucket[0]}_s{bucket[1]}",
+                                               shard_size, token_budget, suffix)
+            writers[bucket].write(line if line.endswith('\n') else line + '\n', function_length, sequence_length)
+
+    buckets = []
+    for (f_bucket, s_bucket), writer in sorted(writers.items()):
+        writer.close()
+        buckets.append({
+            "function_length": [function_edges[f_bucket - 1] if f_bucket else 0,
+                                function_edges[f_bucket] if f_bucket < len(function_edges) else None],
+            "sequence_length": [sequence_edges[s_bucket - 1] if s_bucket else 0,
+                                sequence_edges[s_bucket] if s_bucket < len(sequence_edges) else None],
+            "shards": writer.shards,
+        })
+
+    manifest = {
+        "source": os.path.basename(records_path),
+        "token_budget": token_budget,
+        "function_edges": function_edges,
+        "sequence_edges": sequence_edges,
+        "records": sum(s["records"] for b in buckets for s in b["shards"]),
+        "buckets": buckets,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_packs(index_path: str) -> List[np.ndarray]:
+    """Returns the packing plan of a shard as a list of record index arrays."""
+    with np.load(index_path) as index:
+        offsets = index["pack_offsets"]
+        indices = index["pack_indices"]
+    return [indices[offsets[k]:offsets[k + 1]] for k in range(len(offsets) - 1)]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Write length-bucketed, packing-ready shards of a stage 5 JSONL file.")
+    parser.add_argument("records_path")
+    parser.add_argument("out_dir")
+    parser.add_argument("--token-budget", type=int, required=True)
+    parser.add_argument("--shard-size", type=int, default=100000)
+    args = parser.parse_args()
+
+    manifest = write_length_bucketed_shards(args.records_path, args.out_dir, args.token_budget, args.shard_size)
+    print(f"{manifest['records']:,} records written to {len(manifest['buckets'])} buckets in {args.out_dir}")
@@ -0,0 +1,156 @@
+import json
+import math
+import os
+import shutil
+import tempfile
+from typing import Dict, Optional
+
+import numpy as np
+
+from compressed_io import open_file, uncompressed_size
+
+# Python keeps a line in memory as roughly twice its uncompressed size.
+_MEMORY_OVERHEAD = 2.0
+_SCATTER_BATCH = 65536
+# Lines are assigned to this many virtual buckets, which are grouped into the
+# temporary bucket files; the order depends only on the virtual buckets.
+_VIRTUAL_BUCKETS = 4096
+
+
+def external_shuffle(in_path: str, out_dir: str, num_shards: int, seed: int = 42,
+                     memory_budget: int = 8 * 1024 ** 3, num_buckets: Optional[int] = None,
+                     suffix: str = "", tmp_dir: Optional[str] = None) -> Dict[str, any]:
+    """
+    Globally shuffles a JSONL file that does not fit in memory.
+
+    Pass 1 assigns every line to one of 4096 virtual buckets chosen
+    uniformly at random and writes it to the temporary file holding that
+    virtual bucket (`num_buckets` files, each a contiguous range of virtual
+    buckets). Pass 2 loads one file at a time and appends its virtual
+    buckets in order, each shuffled with its own seeded permutation. The
+    concatenation of independently shuffled random buckets is a uniform
+    random permutation, which is then cut into `num_shards` shards of
+    (almost) equal size.
+
+    The output depends only on the input and `seed`: `num_buckets`, derived
+    from the uncompressed input size and `memory_budget` when None, only
+    decides how many virtual buckets are held in memory at once.
+
+    Args:
+        in_path: JSONL file to shuffle.
+        out_dir: Directory for `shuffled_<n>.jsonl` shards and manifest.json.
+        num_shards: Number of output shards.
+        seed: Random seed.
+        memory_budget: Approximate bytes one bucket may take in memory.
+        num_buckets: Number of temporary buckets (overrides memory_budget).
+        suffix: Compression suffix for the shards ("", ".gz" or ".zst").
+        tmp_dir: Where to put the temporary buckets (defaults to out_dir).
+
+    Returns:
+        The manifest.
+    """
+    if num_shards < 1:
+        raise ValueError(f"num_shards must be at least 1, got {num_shards}")
+    if num_buckets is None:
+        num_buckets = max(1, math.ceil(uncompressed_size(in_path) * _MEMORY_OVERHEAD / memory_budget))
+    num_buckets = min(num_buckets, _VIRTUAL_BUCKETS)
+
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    bucket_dir = tempfile.mkdtemp(prefix="shuffle_", dir=tmp_dir or out_dir)
+
+    try:
+        # --- pass 1: scatter ---
+        buckets = [open(os.path.join(bucket_dir, f"{k:05d}.jsonl"), 'w') for k in range(num_buckets)]
+        total = 0
+        try:
+            with open_file(in_path, 'r') as f:
+                batch = []
+                for line in f:
+                    if not line.strip():
+                        continue
+                    batch.append(line if line.endswith('\n') else line + '\n')
+                    if len(batch) == _SCATTER_BATCH:
+                        _scatter(batch, buckets, rng)
+                        total += len(batch)
+                        batch = []
+                _scatter(batch, buckets, rng)
+                total += len(batch)
+        finally:
+            for b in buckets:
+                b.close()
+
+        # --- pass 2: shuffle each bucket, cut into shards ---
+        shard_sizes = [total // num_shards + (1 if n < total % num_shards else 0) for n in range(num_shards)]
+        shards = []
+        shard_index = -1
+        out = None
+        remaining = 0
+        try:
+            for k in range(num_buckets):
+                bucket_path = os.path.join(bucket_dir, f"{k:05d}.jsonl")
+                with open(bucket_path, 'r') as f:
+                    entries = [line.split('\t', 1) for line in f]
+                os.remove(bucket_path)
+                virtual = np.fromiter((int(v) for v, _ in entries), dtype=np.int64, count=len(entries))
+                lines = [line for _, line in entries]
+                del entries
+
+                order = np.argsort(virtual, kind='stable')
+                bounds = np.flatnonzero(np.diff(virtual[order])) + 1
+                permuted = [group[np.random.default_rng([seed, int(virtual[group[0]])]).permutation(len(group))]
+                            for group in np.split(order, bounds) if len(group)]
+                for i in (np.concatenate(permuted) if permuted else order).tolist():
+                    while remaining == 0:
+                        if out is not None:
+                            out.close()
+                        shard_index += 1
+                        path = f"shuffled_{shard_index:05d}.jsonl{suffix}"
+                        shards.append({"path": path, "records": shard_sizes[shard_index]})
+                        out = open_file(os.path.join(out_dir, path), 'w')
+                        remaining = shard_sizes[shard_index]
+                    out.write(lines[i])
+                    remaining -= 1
+        finally:
+            if out is not None:
+                out.close()
+    finally:
+        shutil.rmtree(bucket_dir, ignore_errors=True)
+
+    manifest = {
+        "source": os.path.basename(in_path),
+        "seed": seed,
+        "num_buckets": num_buckets,
+        "records": total,
+        "shards": shards,
+    }
+    with open(os.path.join(out_dir, "manifest.json"), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def _scatter(lines, buckets, rng):
+    if not lines:
+        return
+    virtual = rng.integers(0, _VIRTUAL_BUCKETS, size=len(lines))
+    targets = virtual * len(buckets) // _VIRTUAL_BUCKETS
+    for line, v, k in zip(lines, virtual.tolist(), targets.tolist()):
+        buckets[k].write(f"{v}\t{line}")
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Seeded external-memory shuffle of a JSONL file into shards.")
+    parser.add_argument("in_path")
+    parser.add_argument("out_dir")
+    parser.add_argument("--num-shards", type=int, default=64)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--memory-gb", type=float, default=8.0)
+    parser.add_argument("--num-buckets", type=int, default=None)
+    args = parser.parse_args()
+
+    manifest = external_shuffle(args.in_path, args.out_dir, args.num_shards, args.seed,
+                                int(args.memory_gb * 1024 ** 3), args.num_buckets)
+    print(f"{manifest['records']:,} records shuffled into {len(manifest['shards'])} shards "
+          f"({manifest['num_buckets']} buckets) in {args.out_dir}")
@@ -0,0 +1,310 @@
+import hashlib
+import json
+import math
+import os
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import ijson
+import numpy as np
+
+from compressed_io import open_file, open_seekable, resolve_path
+
+_BATCH_SIZE = 65536
+_RANGE_BYTES = 256 * 1024
+
+# keys of a top-level JSON object / of one-key JSONL records
+_JSON_KEY = re.compile(rb'[{,]\s*"([^"\\]+)"\s*:')
+_JSONL_KEY = re.compile(rb'^\{\s*"([^"\\]+)"\s*:', re.MULTILINE)
+
+
+def hash_keys(keys: List[str]) -> np.ndarray:
+    """64-bit hashes of a batch of keys."""
+    return np.fromiter((int.from_bytes(hashlib.blake2b(k.encode('utf-8'), digest_size=8).digest(), 'little')
+                        for k in keys), dtype=np.uint64, count=len(keys))
+
+
+class HyperLogLog:
+    """HyperLogLog cardinality sketch with 2^p registers (relative error about 1.04 / sqrt(2^p))."""
+
+    def __init__(self, p: int = 14, registers: Optional[np.ndarray] = None):
+        self.p = p
+        self.registers = registers if registers is not None else np.zeros(1 << p, dtype=np.uint8)
+
+    def add_hashes(self, hashes: np.ndarray):
+        if len(hashes) == 0:
+            return
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = hashes & np.uint64((1 << (64 - self.p)) - 1)
+        bit_length = np.frexp(rest.astype(np.float64))[1]
+        rank = (64 - self.p - bit_length + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rank)
+
+    def merge(self, other: "HyperLogLog") -> "HyperLogLog":
+        return HyperLogLog(self.p, np.maximum(self.registers, other.registers))
+
+    def count(self) -> float:
+        m = len(self.registers)
+        estimate = 0.7213 / (1 + 1.079 / m) * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            estimate = m * math.log(m / zeros)
+        return float(estimate)
+
+    @property
+    def relative_error(self) -> float:
+        return 1.04 / math.sqrt(len(self.registers))
+
+
+class KMVSketch:
+    """k minimum hash values; a uniform sample of the set that supports intersections and differences."""
+
+    def __init__(self, k: int = 4096, values: Optional[np.ndarray] = None):
+        self.k = k
+        self.values = values if values is not None else np.zeros(0, dtype=np.uint64)
+
+    def add_hashes(self, hashes: np.ndarray):
+        self.values = np.unique(np.concatenate([self.values, hashes]))[:self.k]
+
+    @property
+    def exact(self) -> bool:
+        """True while the sketch still holds every value of the set."""
+        return len(self.values) < self.k
+
+
+class FileSketch:
+    """
+    HLL + KMV sketch of the keys of one input file. For a byte-range sample,
+    `fraction` < 1, `range_keys` holds the number of keys found in each
+    sampled range and `slots` the number of ranges the file was split into.
+    """
+
+    def __init__(self, hll: HyperLogLog, kmv: KMVSketch, fraction: float = 1.0, keys: int = 0,
+                 range_keys: Optional[np.ndarray] = None, slots: int = 0):
+        self.hll = hll
+        self.kmv = kmv
+        self.fraction = fraction
+        self.keys = keys
+        self.range_keys = range_keys if range_keys is not None else np.zeros(0, dtype=np.int64)
+        self.slots = slots
+
+    @property
+    def sampling_variance(self) -> float:
+        """Relative variance of a total scaled up from the sampled ranges (0 for a full pass)."""
+        n = len(self.range_keys)
+        if self.fraction >= 1 or n == 0:
+            return 0.0
+        mean = float(self.range_keys.mean())
+        if n < 2 or mean == 0:
+            return 1.0
+        # simple random sample of n out of `slots` ranges
+        return (1 - n / max(self.slots, n)) * float(self.range_keys.var(ddof=1)) / n / mean ** 2
+
+    def save(self, path: str):
+        np.savez(path, registers=self.hll.registers, values=self.kmv.values, range_keys=self.range_keys,
+                 meta=np.asarray([self.hll.p, self.kmv.k, self.fraction, self.keys, self.slots], dtype=np.float64))
+
+    @classmethod
+    def load(cls, path: str) -> "FileSketch":
+        with np.load(path) as data:
+            p, k, fraction, keys, slots = data["meta"].tolist()
+            return cls(HyperLogLog(int(p), data["registers"]), KMVSketch(int(k), data["values"]), fraction, int(keys),
+                       data["range_keys"], int(slots))
+
+
+def _stream_keys(path: str, jsonl: bool) -> Iterable[str]:
+    if jsonl:
+        with open_file(path, 'r') as f:
+            for line in f:
+                if line.strip():
+                    yield next(iter(json.loads(line)))
+    else:
+        with open_file(path, 'rb') as f:
+            for prefix, event, value in ijson.parse(f):
+                if event == 'map_key' and prefix == '':
+                    yield value
+
+
+def file_seed(path: str, seed: int) -> int:
+    """
+    Sampling seed of one file. Raw files share their key order, so sampling
+    the same byte offsets in each would select the same accessions in all
+    of them.
+    """
+    data = f"{seed}:{os.path.basename(resolve_path(path))}".encode('utf-8')
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), 'little')
+
+
+def _sampled_keys(path: str, jsonl: bool, fraction: float,
+                  seed: int) -> Tuple[Iterable[str], float, np.ndarray, int]:
+    """
+    Keys found in randomly placed byte ranges covering about `fraction` of
+    the file. Keys cut by a range boundary are not matched.
+
+    Returns:
+        (keys, fraction actually read, keys per sampled range, number of ranges in the file)
+    """
+    with open_seekable(path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        slots = max(1, size // _RANGE_BYTES)
+        num_ranges = min(slots, max(1, math.ceil(fraction * slots)))
+        starts = np.sort(np.random.default_rng(seed).choice(slots, size=num_ranges, replace=False)) * _RANGE_BYTES
+        keys = []
+        range_keys = []
+        pattern = _JSONL_KEY if jsonl else _JSON_KEY
+        for start in starts.tolist():
+            f.seek(start)
+            chunk = f.read(_RANGE_BYTES)
+            if jsonl and start > 0:
+                # skip the partial line the range starts in
+                chunk = chunk[chunk.find(b"\n") + 1:]
+            found = pattern.findall(chunk)
+            keys.extend(m.decode('utf-8') for m in found)
+            range_keys.append(len(found))
+    return keys, min(1.0, num_ranges * _RANGE_BYTES / max(size, 1)), np.asarray(range_keys, dtype=np.int64), slots
+
+
+def file_fingerprint(path: str, **params) -> str:
+    path = resolve_path(path)
+    stat = os.stat(path)
+    data = json.dumps([os.path.abspath(path), stat.st_size, stat.st_mtime_ns, params], sort_keys=True)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def sketch_file(path: str, jsonl: bool = False, p: int = 14, k: int = 4096, sample_fraction: Optional[float] = None,
+                seed: int = 42, cache_dir: Optional[str] = "sketch_cache") -> FileSketch:
+    """
+    Sketches the keys of a JSON object file (or a JSONL file with one key per
+    record) in one streaming pass, or from byte-range samples when
+    `sample_fraction` is given (placed with a seed derived from `seed` and
+    the file name). Sketches are cached in `cache_dir` by file path, size,
+    modification time and sketch parameters.
+    """
+    seed = file_seed(path, seed)
+    cache_path = None
+    if cache_dir:
+        fingerprint = file_fingerprint(path, jsonl=jsonl, p=p, k=k, sample_fraction=sample_fraction, seed=seed)
+        cache_path = os.path.join(cache_dir, f"{fingerprint}.npz")
+        if os.path.exists(cache_path):
+            return FileSketch.load(cache_path)
+
+    fraction = 1.0
+    range_keys, slots = None, 0
+    if sample_fraction is not None and sample_fraction < 1:
+        try:
+            keys, fraction, range_keys, slots = _sampled_keys(path, jsonl, sample_fraction, seed)
+        except ValueError as e:
+            # gzip and non-seekable zstd files cannot be sampled by byte range
+            print(f"{e}; sketching the whole file instead")
+            keys = _stream_keys(path, jsonl)
+    else:
+        keys = _stream_keys(path, jsonl)
+
+    sketch = FileSketch(HyperLogLog(p), KMVSketch(k), fraction, range_keys=range_keys, slots=slots)
+    batch = []
+    for key in keys:
+        batch.append(key)
+        if len(batch) == _BATCH_SIZE:
+            hashes = hash_keys(batch)
+            sketch.hll.add_hashes(hashes)
+            sketch.kmv.add_hashes(hashes)
+            sketch.keys += len(batch)
+            batch = []
+    hashes = hash_keys(batch)
+    sketch.hll.add_hashes(hashes)
+    sketch.kmv.add_hashes(hashes)
+    sketch.keys += len(batch)
+
+    if cache_path:
+        os.makedirs(cache_dir, exist_ok=True)
+        sketch.save(cache_path)
+    return sketch
+
+
+def estimate(sketches: Dict[str, FileSketch], terms: List[Tuple[int, Tuple[str, ...]]],
+             z: float = 1.96) -> Tuple[float, float]:
+    """
+    Estimates a signed sum of intersection sizes, e.g. [(1, ("S",)), (-1, ("S", "T"))] for |S - T|.
+
+    The k smallest hashes of the union of all involved sets are a uniform
+    sample of that union, and every KMV sketch contains all of its own
+    hashes below that threshold, so set membership of each sampled hash is
+    known. The estimate is the union size times the mean of the signed
+    membership indicator.
+
+    Byte-range samples are only used for single-set terms, scaled up by the
+    inverse of the read fraction. Their ranges hold runs of consecutive
+    keys, so the intersection of two samples has no usable error bound.
+
+    Returns:
+        (estimate, half-width of the ~95% interval for z=1.96)
+    """
+    for _, sets in terms:
+        if len(sets) > 1 and any(sketches[name].fraction < 1 for name in sets):
+            raise ValueError(f"Intersection {'&'.join(sets)} of byte-range samples cannot be estimated")
+    names = sorted({name for _, sets in terms for name in sets})
+    k = min(sketches[name].kmv.k for name in names)
+    union_values = np.unique(np.concatenate([sketches[name].kmv.values for name in names]))[:k]
+    exact = len(union_values) < k and all(sketches[name].kmv.exact for name in names)
+
+    union_hll = sketches[names[0]].hll
+    for name in names[1:]:
+        union_hll = union_hll.merge(sketches[name].hll)
+    union_size = float(len(union_values)) if exact else union_hll.count()
+
+    member = {name: np.isin(union_values, sketches[name].kmv.values) for name in names}
+    weights = np.zeros(len(union_values))
+    sampled_terms = []
+    for sign, sets in terms:
+        in_all = np.logical_and.reduce([member[name] for name in sets])
+        sketch = sketches[sets[0]]
+        scale = 1.0 / sketch.fraction if len(sets) == 1 else 1.0
+        weights += sign * scale * in_all
+        if scale > 1:
+            sampled_terms.append((union_size * in_all.mean() * scale if len(in_all) else 0.0, sketch))
+
+    n = max(len(union_values), 1)
+    value = union_size * float(weights.mean()) if len(weights) else 0.0
+    variance = 0.0
+    if not exact:
+        # at least one hit's worth of sampling error, so an empty sample does not claim certainty
+        max_scale = max([1.0] + [1.0 / sketch.fraction for _, sketch in sampled_terms])
+        variance += union_size ** 2 * max(float(weights.var()), max_scale ** 2 / n) / n
+        variance += (value * union_hll.relative_error) ** 2
+    # byte-range sampling: spread of the key counts over the sampled ranges
+    variance += sum((total ** 2) * sketch.sampling_variance for total, sketch in sampled_terms)
+    return value, z * math.sqrt(variance)
+
+
+# The counts printed by 1. intersection_curation.py, as signed sums of
+# intersections of L (protein2ligand), S (uniprot2seq), T (uniprot2text) and U (uniref50).
+STAGE1_COUNTS = [
+    ("Protein to Ligand IDs", [(1, ("L",))]),
+    ("UniProt to Sequence", [(1, ("S",))]),
+    ("UniProt to Text", [(1, ("T",))]),
+    ("Ligand, Sequence, and Text intersection", [(1, ("L", "S", "T"))]),
+    ("Sequence and Text intersection", [(1, ("S", "T"))]),
+    ("Ligand and Text intersection", [(1, ("L", "T"))]),
+    ("Elements in seq not in text", [(1, ("S",)), (-1, ("S", "T"))]),
+    ("Elements in ligand but not in text", [(1, ("L",)), (-1, ("L", "T"))]),
+    ("Elements in ligand and text but not in seq", [(1, ("L", "T")), (-1, ("L", "S", "T"))]),
+    ("Uniref50 keys", [(1, ("U",))]),
+    ("Biggest intersection after adding Uniref50", [(1, ("L", "T", "U"))]),
+    ("Total uniprot ids after adding Uniref50", [(1, ("L", "S", "T")), (1, ("L", "T", "U")), (-1, ("L", "S", "T", "U"))]),
+]
+
+
+def estimate_stage1(raw_dir: str, p: int = 14, k: int = 4096, sample_fraction: Optional[float] = None,
+                    seed: int = 42, cache_dir: Optional[str] = "sketch_cache") -> Dict[str, Tuple[float, float]]:
+    """The STAGE1_COUNTS estimates; only the per-file counts when sampling byte ranges."""
+    inputs = {
+        "L": (f"{raw_dir}/protein2ligand_id.json", False),
+        "S": (f"{raw_dir}/uniprot2seq.json", False),
+        "T": (f"{raw_dir}/uniprot2text.json", False),
+        "U": (f"{raw_dir}/uniref50.jsonl", True),
+    }
+    sketches = {name: sketch_file(path, jsonl, p, k, sample_fraction, seed, cache_dir)
+                for name, (path, jsonl) in inputs.items()}
+    sampled = any(sketch.fraction < 1 for sketch in sketches.values())
+    return {label: estimate(sketches, terms) for label, terms in STAGE1_COUNTS
+            if not sampled or all(len(sets) == 1 for _, sets in terms)}
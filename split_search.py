@@ -0,0 +1,260 @@
+import json
+import os
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import scipy.sparse as sp
+
+from compressed_io import open_file
+from incidence import ClusterLigandIncidence
+
+data_path = "/mnt/gemini/data/ramith/CMU-project/data/raw"
+
+# Same size bins and per-bin counts as 3. split_sets.py
+SAMPLING_RANGES = [
+    ((1, 501), 40),
+    ((501, 1001), 20),
+    ((1001, 2501), 10),
+    ((2501, float("inf")), 2),
+]
+
+DEFAULT_WEIGHTS = {"pair_imbalance": 1.0, "ligand_overlap": 1.0, "bin_imbalance": 1.0}
+
+
+def size_bins(cluster_sizes: np.ndarray, sampling_ranges=SAMPLING_RANGES) -> Tuple[List[np.ndarray], np.ndarray]:
+    """
+    Returns the clusters of every size bin and, per cluster, its bin index
+    (-1 for clusters outside every bin).
+    """
+    bin_of_cluster = np.full(len(cluster_sizes), -1, dtype=np.int32)
+    members = []
+    for b, ((low, high), _) in enumerate(sampling_ranges):
+        in_bin = (cluster_sizes >= low) & (cluster_sizes < high)
+        bin_of_cluster[in_bin] = b
+        members.append(np.flatnonzero(in_bin))
+    return members, bin_of_cluster
+
+
+def draw_candidates(bin_members: List[np.ndarray], sampling_ranges, num_candidates: int,
+                    rng: np.random.Generator) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Draws `num_candidates` stratified val/test splits at once.
+
+    Like 3. split_sets.py, each bin contributes its desired number of
+    clusters (or all of them if it has fewer), the first half of which goes
+    to validation and the rest to test.
+
+    Returns:
+        (val, test) cluster index arrays of shape (num_candidates, n_val/n_test).
+    """
+    val_parts = []
+    test_parts = []
+    for members, (_, desired) in zip(bin_members, sampling_ranges):
+        desired = min(desired, len(members))
+        if desired == 0:
+            continue
+        keys = rng.random((num_candidates, len(members)))
+        chosen = np.argpartition(keys, desired - 1, axis=1)[:, :desired] if desired < len(members) \
+            else np.argsort(keys, axis=1)
+        chosen = members[chosen]
+        half = desired // 2
+        val_parts.append(chosen[:, :half])
+        test_parts.append(chosen[:, half:])
+    return np.concatenate(val_parts, axis=1), np.concatenate(test_parts, axis=1)
+
+
+def _selection_matrix(idx: np.ndarray, n_clusters: int) -> sp.csr_matrix:
+    k, n = idx.shape
+    return sp.csr_matrix((np.ones(k * n, dtype=np.int32), idx.ravel(), np.arange(0, k * n + 1, n)),
+                         shape=(k, n_clusters))
+
+
+def score_candidates(val: np.ndarray, test: np.ndarray, cluster_sizes: np.ndarray, cluster_pairings: np.ndarray,
+                     incidence: sp.csr_matrix, bin_of_cluster: np.ndarray, n_bins: int,
+                     weights: Optional[Dict[str, float]] = None) -> Dict[str, np.ndarray]:
+    """
+    Scores a batch of candidate splits; lower `score` is better.
+
+    Components (each in [0, 1]):
+        pair_imbalance: |val pairings - test pairings| / total pairings
+        ligand_overlap: Jaccard overlap of the val and test ligand sets;
+                        overlapping ligands cannot serve as unseen ligands
+        bin_imbalance:  sum over size bins of |val proteins - test proteins| / total proteins
+    """
+    weights = {**DEFAULT_WEIGHTS, **(weights or {})}
+    k = len(val)
+    n_clusters = len(cluster_sizes)
+
+    pairs_val = cluster_pairings[val].sum(axis=1)
+    pairs_test = cluster_pairings[test].sum(axis=1)
+    pair_imbalance = np.abs(pairs_val - pairs_test) / np.maximum(pairs_val + pairs_test, 1)
+
+    ligands_val = _selection_matrix(val, n_clusters) @ incidence
+    ligands_test = _selection_matrix(test, n_clusters) @ incidence
+    coverage_val = ligands_val.getnnz(axis=1)
+    coverage_test = ligands_test.getnnz(axis=1)
+    overlap = ligands_val.multiply(ligands_test).getnnz(axis=1)
+    ligand_overlap = overlap / np.maximum(coverage_val + coverage_test - overlap, 1)
+
+    rows = np.repeat(np.arange(k), val.shape[1])
+    size_val = np.bincount(rows * n_bins + bin_of_cluster[val].ravel(), weights=cluster_sizes[val].ravel(),
+                           minlength=k * n_bins).reshape(k, n_bins)
+    rows = np.repeat(np.arange(k), test.shape[1])
+    size_test = np.bincount(rows * n_bins + bin_of_cluster[test].ravel(), weights=cluster_sizes[test].ravel(),
+                            minlength=k * n_bins).reshape(k, n_bins)
+    bin_imbalance = np.abs(size_val - size_test).sum(axis=1) / np.maximum((size_val + size_test).sum(axis=1), 1)
+
+    score = (weights["pair_imbalance"] * pair_imbalance
+             + weights["ligand_overlap"] * ligand_overlap
+             + weights["bin_imbalance"] * bin_imbalance)
+    return {
+        "score": score,
+        "pair_imbalance": pair_imbalance,
+        "ligand_overlap": ligand_overlap,
+        "bin_imbalance": bin_imbalance,
+        "val_pairings": pairs_val,
+        "test_pairings": pairs_test,
+        "val_ligands": coverage_val,
+        "test_ligands": coverage_test,
+        "val_only_ligands": coverage_val - overlap,
+        "test_only_ligands": coverage_test - overlap,
+    }
+
+
+def search_splits(cluster_sizes: np.ndarray, counts: sp.csr_matrix, num_candidates: int = 100000,
+                  batch_size: int = 2000, seed: int = 42, sampling_ranges=SAMPLING_RANGES,
+                  weights: Optional[Dict[str, float]] = None) -> Dict[str, any]:
+    """
+    Scores `num_candidates` stratified draws in batches and keeps the best.
+    Batch b is drawn from np.random.default_rng([seed, b]), so the result is
+    reproducible for a given seed and batch size. `counts` is the
+    clusters x ligands pair count matrix (ClusterLigandIncidence.counts).
+
+    Returns:
+        dict with the best 'val' and 'test' cluster indices, its 'metrics',
+        its 'batch' and 'index' and score quantiles over all candidates.
+    """
+    bin_members, bin_of_cluster = size_bins(cluster_sizes, sampling_ranges)
+    incidence = (counts > 0).astype(np.int32).tocsr()
+    cluster_pairings = np.asarray(counts.sum(axis=1)).ravel()
+
+    best = None
+    scores = []
+    for b, start in enumerate(range(0, num_candidates, batch_size)):
+        rng = np.random.default_rng([seed, b])
+        val, test = draw_candidates(bin_members, sampling_ranges, min(batch_size, num_candidates - start), rng)
+        metrics = score_candidates(val, test, cluster_sizes, cluster_pairings, incidence,
+                                   bin_of_cluster, len(sampling_ranges), weights)
+        scores.append(metrics["score"])
+        i = int(np.argmin(metrics["score"]))
+        if best is None or metrics["score"][i] < best["metrics"]["score"]:
+            best = {
+                "val": val[i],
+                "test": test[i],
+                "batch": b,
+                "index": i,
+                "metrics": {name: values[i].item() for name, values in metrics.items()},
+            }
+
+    scores = np.concatenate(scores)
+    best["score_quantiles"] = {q: float(np.quantile(scores, q)) for q in (0.0, 0.01, 0.5, 0.99, 1.0)}
+    return best
+
+
+def score_split(val_ids: Sequence[str], test_ids: Sequence[str], cluster_names: np.ndarray,
+                cluster_sizes: np.ndarray, counts: sp.csr_matrix, sampling_ranges=SAMPLING_RANGES,
+                weights: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+    """
+    Scores an existing split (e.g. the current val_clusters.txt / test_clusters.txt) the same way.
+
+    Raises:
+        ValueError if the split names clusters that are not in `cluster_names`.
+    """
+    index = {name: i for i, name in enumerate(cluster_names)}
+    unknown = [c for c in list(val_ids) + list(test_ids) if c not in index]
+    if unknown:
+        raise ValueError(f"{len(unknown)} clusters of the split are not in the incidence index, "
+                         f"e.g. {unknown[:5]}")
+    val = np.asarray([[index[c] for c in val_ids]])
+    test = np.asarray([[index[c] for c in test_ids]])
+    _, bin_of_cluster = size_bins(cluster_sizes, sampling_ranges)
+    bin_of_cluster = np.where(bin_of_cluster < 0, 0, bin_of_cluster)
+    metrics = score_candidates(val, test, cluster_sizes, np.asarray(counts.sum(axis=1)).ravel(),
+                               (counts > 0).astype(np.int32).tocsr(), bin_of_cluster, len(sampling_ranges), weights)
+    return {name: values[0].item() for name, values in metrics.items()}
+
+
+def _read_ids(path: str) -> List[str]:
+    with open(path, 'r') as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Search many stratified val/test cluster splits and keep the best balanced one.")
+    parser.add_argument("--num-candidates", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=2000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--weights", default=None,
+                        help='JSON object overriding the score weights, e.g. \'{"ligand_overlap": 2}\'.')
+    parser.add_argument("--out-dir", default="split_search",
+                        help="Where to write the *_clusters.txt files and the report (a new directory by default, "
+                             "so the committed split is only replaced by copying the files over).")
+    parser.add_argument("--current-split", default=".",
+                        help="Directory with the split in use, scored in the report for comparison.")
+    parser.add_argument("--cluster-mapping", default=f"{data_path}/data/clusterRes_cluster.tsv")
+    parser.add_argument("--protein2ligand", default=f"{data_path}/data/protein2ligand_id.json")
+    parser.add_argument("--incidence", default=None,
+                        help="Prefix of a matrix saved by incidence.py, instead of building it here.")
+    args = parser.parse_args()
+
+    weights = json.loads(args.weights) if args.weights else None
+
+    if args.incidence:
+        inc = ClusterLigandIncidence.load(args.incidence)
+    else:
+        with open_file(args.protein2ligand, 'r') as f:
+            protein2ligand = json.load(f)
+        inc = ClusterLigandIncidence.build(args.cluster_mapping, protein2ligand)
+        del protein2ligand
+    cluster_names, cluster_sizes, counts = inc.cluster_names, inc.cluster_sizes, inc.counts
+    print(f"Loaded {len(cluster_names):,} clusters and {counts.shape[1]:,} ligands ({counts.sum():,} pairings).")
+
+    best = search_splits(cluster_sizes, counts, args.num_candidates, args.batch_size, args.seed, weights=weights)
+
+    report = {
+        "seed": args.seed,
+        "num_candidates": args.num_candidates,
+        "batch_size": args.batch_size,
+        "weights": {**DEFAULT_WEIGHTS, **(weights or {})},
+        "best": {"batch": best["batch"], "index": best["index"], **best["metrics"]},
+        "score_quantiles": best["score_quantiles"],
+    }
+    # score the split currently in use, if there is one, for comparison
+    current_val = os.path.join(args.current_split, "val_clusters.txt")
+    current_test = os.path.join(args.current_split, "test_clusters.txt")
+    if os.path.exists(current_val) and os.path.exists(current_test):
+        try:
+            report["previous"] = score_split(_read_ids(current_val), _read_ids(current_test),
+                                             cluster_names, cluster_sizes, counts, weights=weights)
+        except ValueError as e:
+            # e.g. a split made from an older clustering; the new split is still written
+            print(f"Not scoring the current split: {e}")
+            report["previous"] = {"error": str(e)}
+
+    os.makedirs(args.out_dir, exist_ok=True)
+    val_ids = cluster_names[best["val"]].tolist()
+    test_ids = cluster_names[best["test"]].tolist()
+    selected = set(val_ids) | set(test_ids)
+    for file_name, ids in (("val_clusters.txt", val_ids), ("test_clusters.txt", test_ids),
+                           ("train_clusters.txt", [c for c in cluster_names if c not in selected])):
+        with open(os.path.join(args.out_dir, file_name), 'w') as f:
+            for cid in ids:
+                f.write(cid + "\n")
+
+    with open(os.path.join(args.out_dir, "split_search_report.json"), 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print(json.dumps(report, indent=2))
+    print(f"val_clusters has {len(val_ids)} clusters, test_clusters has {len(test_ids)} clusters.")
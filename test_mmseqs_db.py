@@ -0,0 +1,47 @@
+import shutil
+import struct
+
+import pytest
+
+from mmseqs_db import DBTYPE_AMINO_ACIDS, DBTYPE_GENERIC_DB, MMseqsDBWriter, verify_against_createdb
+
+ENTRIES = [("P12345", "MKV"), ("Q67890", "ACDE")]
+
+
+def write_db(tmp_path):
+    prefix = str(tmp_path / "db")
+    with MMseqsDBWriter(prefix) as writer:
+        for uniprot_id, sequence in ENTRIES:
+            writer.add(uniprot_id, sequence)
+    return prefix
+
+
+def read(path, mode='r'):
+    with open(path, mode) as f:
+        return f.read()
+
+
+def test_layout(tmp_path):
+    prefix = write_db(tmp_path)
+
+    # every entry ends in "\n\0" and the index lengths include it
+    assert read(prefix, 'rb') == b"MKV\n\0ACDE\n\0"
+    assert read(f"{prefix}.index") == "0\t0\t5\n1\t5\t6\n"
+    assert read(f"{prefix}_h", 'rb') == b"P12345\n\0Q67890\n\0"
+    assert read(f"{prefix}_h.index") == "0\t0\t8\n1\t8\t8\n"
+
+    assert struct.unpack("<i", read(f"{prefix}.dbtype", 'rb')) == (DBTYPE_AMINO_ACIDS,)
+    assert struct.unpack("<i", read(f"{prefix}_h.dbtype", 'rb')) == (DBTYPE_GENERIC_DB,)
+    assert DBTYPE_AMINO_ACIDS == 0 and DBTYPE_GENERIC_DB == 12
+
+    assert read(f"{prefix}.lookup") == "0\tP12345\t0\n1\tQ67890\t0\n"
+    assert read(f"{prefix}.source") == "0\toutput_sequences.fasta\n"
+
+
+@pytest.mark.skipif(shutil.which("mmseqs") is None, reason="mmseqs is not installed")
+def test_matches_createdb(tmp_path):
+    prefix = write_db(tmp_path)
+    fasta = tmp_path / "output_sequences.fasta"
+    fasta.write_text("".join(f">{uniprot_id}\n{sequence}\n" for uniprot_id, sequence in ENTRIES))
+
+    assert verify_against_createdb(prefix, str(fasta))